@@ -0,0 +1,70 @@
+# Import-time benchmark for the API process: fails if importing `main` pulls in the crew stack
+# or if startup regresses past a threshold.
+#
+# Usage (from the repo root):
+#   python benchmarks/api_import_time.py --runs 5 --max-seconds 1.5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the API must never import, they belong to the worker
+FORBIDDEN_MODULES = ("crewai", "crewai_tools", "langchain_community", "litellm", "crew", "celery_jobs.analysis_worker")
+
+# Runs in a fresh interpreter so nothing is already cached in sys.modules
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_once():
+    """Import `main` in a fresh interpreter, returns (seconds, imported module names)"""
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    return report["seconds"], report["modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the API process")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreter imports to take the median of")
+    parser.add_argument("--max-seconds", type=float, default=float(os.getenv("API_IMPORT_MAX_SECONDS", "1.5")),
+                        help="fail if the median import time of `main` exceeds this")
+    args = parser.parse_args()
+
+    timings = []
+    leaked = set()
+    for _ in range(args.runs):
+        seconds, modules = measure_once()
+        timings.append(seconds)
+        leaked.update(
+            name for name in modules
+            if any(name == forbidden or name.startswith(f"{forbidden}.") for forbidden in FORBIDDEN_MODULES)
+        )
+
+    median = statistics.median(timings)
+    print(f"import main: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s over {args.runs} runs")
+
+    failed = False
+    if leaked:
+        print(f"FAIL: API imports worker-only modules: {', '.join(sorted(leaked))}")
+        failed = True
+    if median > args.max_seconds:
+        print(f"FAIL: median import time {median:.3f}s exceeds {args.max_seconds:.3f}s")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Concurrency benchmark for the SQLite job store: many processes poll job status while others write job updates,
+# once with the old setup (new engine + create_all per call, rollback journal) and once with the shared WAL engine.
+#
+# Usage (from the repo root):
+#   python benchmarks/job_db_concurrency.py --readers 16 --writers 4 --seconds 10
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from job_database.job_db import Base, DocumentAnalysisJobDB, DocumentAnalysisJobs  # noqa: E402
+
+SEED_JOBS = 1000
+
+
+def legacy_session(db_path: str):
+    """What every request and task did before: a fresh engine and a schema check, default rollback journal"""
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=True, bind=engine)()
+
+
+def shared_session(db_path: str):
+    return None, DocumentAnalysisJobDB(db_path).get_local_session()()
+
+
+def seed(db_path: str, mode: str) -> list:
+    engine, session = legacy_session(db_path) if mode == "legacy" else shared_session(db_path)
+    jobs = [
+        DocumentAnalysisJobs(file_path=f"data/doc_{index}.pdf", analysis_query="q", job_result="x" * 20000)
+        for index in range(SEED_JOBS)
+    ]
+    session.add_all(jobs)
+    session.commit()
+    job_ids = [job.job_id for job in jobs]
+    session.close()
+    if engine is not None:
+        engine.dispose()
+    return job_ids
+
+
+def worker(mode: str, role: str, db_path: str, job_ids: list, seconds: float, results):
+    """Loop one kind of operation until the deadline, reports (role, latencies, errors)"""
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    index = 0
+    while time.perf_counter() < deadline:
+        job_id = job_ids[index % len(job_ids)]
+        index += 1
+        start = time.perf_counter()
+        engine, session = legacy_session(db_path) if mode == "legacy" else shared_session(db_path)
+        try:
+            if role == "reader":
+                session.query(DocumentAnalysisJobs.job_status).filter(DocumentAnalysisJobs.job_id == job_id).first()
+                session.query(DocumentAnalysisJobs.job_id).filter(DocumentAnalysisJobs.job_status == "Processing") \
+                    .order_by(DocumentAnalysisJobs.created_at.desc()).limit(20).all()
+            else:
+                session.query(DocumentAnalysisJobs).filter(DocumentAnalysisJobs.job_id == job_id).update(
+                    {"job_status": "Processing" if index % 2 else "Completed"}
+                )
+                session.commit()
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            # "database is locked"
+            session.rollback()
+            errors += 1
+        finally:
+            session.close()
+            if engine is not None:
+                engine.dispose()
+    results.put((role, latencies, errors))
+
+
+def run(mode: str, readers: int, writers: int, seconds: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "jobs.db")
+        job_ids = seed(db_path, mode)
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(mode, role, db_path, job_ids, seconds, results))
+            for role in ["reader"] * readers + ["writer"] * writers
+        ]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    summary = {}
+    for role in ("reader", "writer"):
+        latencies = sorted(latency for report_role, role_latencies, _ in reports if report_role == role for latency in role_latencies)
+        errors = sum(role_errors for report_role, _, role_errors in reports if report_role == role)
+        summary[role] = {
+            "ops_per_sec": len(latencies) / seconds,
+            "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float("nan"),
+            "errors": errors,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency benchmark for the SQLite job store")
+    parser.add_argument("--readers", type=int, default=16, help="processes polling job status")
+    parser.add_argument("--writers", type=int, default=4, help="processes updating jobs, like workers do")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duration of each run")
+    parser.add_argument("--modes", nargs="+", default=["legacy", "shared"], choices=["legacy", "shared"])
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s per mode")
+    print(f"{'mode':<8} {'role':<7} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        for role, stats in run(mode, args.readers, args.writers, args.seconds).items():
+            print(f"{mode:<8} {role:<7} {stats['ops_per_sec']:>9.1f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# Offline load test of the whole pipeline: API (uvicorn) and a Celery worker run as separate local processes with
+# the stub LLM and stub search (LLM_BACKEND=stub, SEARCH_BACKEND=stub) and a filesystem broker instead of Redis,
+# while client threads drive /analyze/ + /status/{job_id}/summary. Reports per stage latency percentiles, jobs/sec
+# and the peak RSS of the API and the worker. Nothing is sent to OpenAI or Serper.
+#
+# Usage (from the repo root):
+#   python benchmarks/load_test.py --jobs 20 --concurrency 4 --worker-concurrency 4 --llm-latency 0.2
+#   python benchmarks/load_test.py --jobs 50 --max-p95-seconds 30   # exits 1 on failed jobs or a slower p95
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+STAGES = ("queue_wait", "parsing", "financial_analysis", "investment_analysis", "risk_assessment", "executive_summary", "end_to_end")
+
+
+def make_pdf(pages: int, tag: str) -> bytes:
+    """A small text PDF shaped like an earnings report (narrative pages plus an income statement), `tag` makes its bytes unique"""
+    page_lines = []
+    for page in range(1, pages + 1):
+        if page == 2:
+            lines = [
+                "Consolidated Statements of Operations (in millions, except per share data)",
+                "Q3-2023 Q3-2024",
+                "Total revenues 23,350 25,182",
+                "Gross profit 4,178 4,997",
+                "Income from operations 1,764 2,717",
+                "Net income 1,853 2,167",
+                "Diluted 0.53 0.62",
+            ]
+        else:
+            lines = [
+                f"Quarterly update page {page}: revenue grew on higher deliveries and services revenue.",
+                "Operating margin expanded as cost per unit declined and operating expenses stayed flat.",
+                "Free cash flow remained positive and the company ended the quarter with net cash.",
+                "Management reiterated guidance and flagged pricing and regulatory risks.",
+            ]
+        page_lines.append(lines)
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in page_lines:
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 11 Tf 14 TL 72 720 Td {text}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{kid} 0 R" for kid in kids).encode(), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n%" + tag.encode() + b"\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def configure_local_broker(broker_dir: str):
+    """Point the Celery app at a filesystem broker shared by the API and worker processes (no Redis needed)"""
+    from celery_jobs.celery_app import celery_app
+
+    os.makedirs(broker_dir, exist_ok=True)
+    celery_app.conf.update(
+        broker_url="filesystem://",
+        broker_transport_options={"data_folder_in": broker_dir, "data_folder_out": broker_dir, "store_processed": False},
+        result_backend=None,
+    )
+    return celery_app
+
+
+def run_api(port: int, broker_dir: str):
+    configure_local_broker(broker_dir)
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def run_worker(concurrency: int, broker_dir: str):
+    celery_app = configure_local_broker(broker_dir)
+    from celery.signals import worker_ready
+    import celery_jobs.analysis_worker  # noqa: F401
+
+    # the driver waits for this file, so worker startup (importing crewai) isn't counted as queue wait
+    @worker_ready.connect
+    def _mark_ready(**kwargs):
+        open(os.path.join(broker_dir, "worker.ready"), "w").close()
+
+    from celery_jobs.celery_app import JOB_QUEUES
+    # one worker serves every size class and the default (maintenance) queue
+    celery_app.worker_main([
+        "worker", "--pool=threads", f"--concurrency={concurrency}", "--loglevel=WARNING", "-Q", ",".join([*JOB_QUEUES.values(), "celery"]),
+        "--without-heartbeat", "--without-gossip", "--without-mingle",
+    ])
+
+
+def peak_rss_mb(pid: int):
+    """Peak resident set size of a process (VmHWM), None where procfs isn't available"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def drive(base_url: str, jobs: int, concurrency: int, pages: int, query: str, execution_mode: str, poll_interval: float,
+          timeout: float) -> list:
+    """Submit `jobs` analyses from `concurrency` client threads and follow each until it finishes"""
+    records = []
+    lock = threading.Lock()
+    counter = iter(range(jobs))
+
+    def client():
+        with httpx.Client(base_url=base_url, timeout=60) as http:
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                # unique bytes and query per job, so neither request coalescing nor the caches hide the work
+                pdf = make_pdf(pages, f"load-test-{index}-{time.time_ns()}")
+                submitted = time.time()
+                throttled = 0
+                while True:
+                    response = http.post(
+                        "/analyze/", files={"file": (f"load_{index}.pdf", pdf, "application/pdf")},
+                        data={"query": f"{query} (load test job {index})", "execution_mode": execution_mode},
+                    )
+                    if response.status_code != 429:
+                        break
+                    # admission control turned the job away, come back when the API says the backlog has drained
+                    throttled += 1
+                    time.sleep(float(response.headers.get("Retry-After", "1")))
+                response.raise_for_status()
+                record = {
+                    "job_id": response.json()["job_id"], "submitted": submitted, "processing": None, "finished": None, "status": None,
+                    "throttled": throttled,
+                }
+                deadline = submitted + timeout
+                while time.time() < deadline:
+                    status = http.get(f"/status/{record['job_id']}/summary").json()["job_status"]
+                    now = time.time()
+                    if status != "In Queue" and record["processing"] is None:
+                        record["processing"] = now
+                    if status in ("Completed", "Failed"):
+                        record["finished"], record["status"] = now, status
+                        break
+                    time.sleep(poll_interval)
+                with lock:
+                    records.append(record)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def stage_latencies(records: list, db_path: str):
+    """Seconds per stage and job as measured by the worker (`job_metrics`), plus the token totals per stage"""
+    latencies = {stage: [] for stage in STAGES}
+    tokens = {}
+    connection = sqlite3.connect(db_path)
+    try:
+        for record in records:
+            if record["status"] != "Completed":
+                continue
+            latencies["end_to_end"].append(record["finished"] - record["submitted"])
+            row = connection.execute("SELECT job_metrics FROM document_analysis_jobs WHERE job_id = ?", (record["job_id"],)).fetchone()
+            job_metrics = json.loads(row[0]) if row and row[0] else {}
+            if "queue_wait_seconds" in job_metrics:
+                latencies["queue_wait"].append(job_metrics["queue_wait_seconds"])
+            for stage, stage_metrics in job_metrics.get("stages", {}).items():
+                if stage_metrics.get("seconds") is not None:
+                    latencies.setdefault(stage, []).append(stage_metrics["seconds"])
+                stage_tokens = tokens.setdefault(stage, {"prompt_tokens": 0, "completion_tokens": 0})
+                for field in stage_tokens:
+                    stage_tokens[field] += stage_metrics.get(field, 0)
+    finally:
+        connection.close()
+    return latencies, tokens
+
+
+def wait_until_ready(base_url: str, api: subprocess.Popen, worker: subprocess.Popen, broker_dir: str, timeout: float = 120):
+    deadline = time.time() + timeout
+    api_ready = False
+    while time.time() < deadline:
+        if api.poll() is not None or worker.poll() is not None:
+            raise RuntimeError("API or worker process exited during startup, see processes.log")
+        if not api_ready:
+            try:
+                api_ready = httpx.get(f"{base_url}/", timeout=1).status_code == 200
+            except httpx.HTTPError:
+                pass
+        if api_ready and os.path.exists(os.path.join(broker_dir, "worker.ready")):
+            return
+        time.sleep(0.2)
+    raise RuntimeError("API or worker didn't start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the API + worker pipeline with a stub LLM and stub search")
+    parser.add_argument("--jobs", type=int, default=20, help="analyses to submit")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads submitting and polling")
+    parser.add_argument("--worker-concurrency", type=int, default=4, help="Celery worker threads")
+    parser.add_argument("--pages", type=int, default=12, help="pages per generated document")
+    parser.add_argument("--execution-mode", default="sequential", choices=["sequential", "parallel"])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per stub LLM call")
+    parser.add_argument("--llm-output-tokens", type=int, default=300, help="approximate tokens per stub final answer")
+    parser.add_argument("--llm-tool-calls", type=int, default=1, help="Search PDF Tool calls per agent before answering")
+    parser.add_argument("--agent-max-rpm", type=int, default=0,
+                        help="per agent requests per minute (AGENT_MAX_RPM), 0 = unlimited; deployments default to 1")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds per stub web search")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between status polls")
+    parser.add_argument("--job-timeout", type=float, default=600, help="seconds before a job counts as failed")
+    parser.add_argument("--max-p95-seconds", type=float, default=None, help="fail if the end-to-end p95 is above this")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report to this file")
+    parser.add_argument("--role", choices=["api", "worker"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--broker-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child processes started below
+    if args.role == "api":
+        return run_api(args.port, args.broker_dir)
+    if args.role == "worker":
+        return run_worker(args.worker_concurrency, args.broker_dir)
+
+    with tempfile.TemporaryDirectory(prefix="load_test_") as workdir:
+        # every store lives in the temp dir, so runs don't share caches with each other or with a real deployment
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+            LLM_BACKEND="stub", SEARCH_BACKEND="stub", OPENAI_API_KEY="stub", SERPER_API_KEY="stub",
+            STUB_LLM_LATENCY_SECONDS=str(args.llm_latency), STUB_LLM_OUTPUT_TOKENS=str(args.llm_output_tokens),
+            STUB_LLM_TOOL_CALLS=str(args.llm_tool_calls), STUB_SEARCH_LATENCY_SECONDS=str(args.search_latency),
+            AGENT_MAX_RPM=str(args.agent_max_rpm),
+            JOB_DB_PATH=os.path.join(workdir, "jobs.db"), LLM_CACHE_DB_PATH=os.path.join(workdir, "responses.db"),
+            SEARCH_CACHE_DB_PATH=os.path.join(workdir, "search.db"), PDF_CACHE_DIR=os.path.join(workdir, "pdf_pages"),
+            OTEL_SDK_DISABLED="true", CREWAI_DISABLE_TELEMETRY="true",
+        )
+        broker_dir = os.path.join(workdir, "broker")
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        script = os.path.abspath(__file__)
+        log = open(os.path.join(workdir, "processes.log"), "w")
+        api = subprocess.Popen([sys.executable, script, "--role", "api", "--port", str(port), "--broker-dir", broker_dir],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        worker = subprocess.Popen([sys.executable, script, "--role", "worker", "--worker-concurrency", str(args.worker_concurrency),
+                                   "--broker-dir", broker_dir], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            wait_until_ready(base_url, api, worker, broker_dir)
+            started = time.time()
+            records = drive(base_url, args.jobs, args.concurrency, args.pages, "Analyze this financial document for investment insights",
+                            args.execution_mode, args.poll_interval, args.job_timeout)
+            elapsed = max(record["finished"] or time.time() for record in records) - started
+            rss = {"api": peak_rss_mb(api.pid), "worker": peak_rss_mb(worker.pid)}
+        finally:
+            for process in (api, worker):
+                process.terminate()
+            for process in (api, worker):
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            log.close()
+
+        completed = [record for record in records if record["status"] == "Completed"]
+        latencies, tokens = stage_latencies(records, env["JOB_DB_PATH"])
+
+    report = {
+        "jobs": len(records),
+        "completed": len(completed),
+        "failed_or_timed_out": len(records) - len(completed),
+        "elapsed_seconds": elapsed,
+        "jobs_per_sec": len(completed) / elapsed if elapsed else 0.0,
+        "throttled_submissions": sum(record["throttled"] for record in records),
+        "peak_rss_mb": rss,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": statistics.median(values),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+            }
+            for stage, values in latencies.items() if values
+        },
+        "tokens": tokens,
+    }
+
+    print(f"{report['completed']}/{report['jobs']} jobs completed in {elapsed:.1f}s -> {report['jobs_per_sec']:.2f} jobs/sec")
+    if report["throttled_submissions"]:
+        print(f"{report['throttled_submissions']} submissions were turned away by admission control (429) and retried")
+    print(f"peak RSS: API {rss['api'] or float('nan'):.0f} MB, worker {rss['worker'] or float('nan'):.0f} MB")
+    print(f"{'stage':<20} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<20} {stats['p50']:>8.2f} {stats['p95']:>8.2f} {stats['p99']:>8.2f}")
+    for stage, stage_tokens in tokens.items():
+        if stage_tokens["prompt_tokens"]:
+            print(f"{stage:<20} {stage_tokens['prompt_tokens']:>8} prompt tokens {stage_tokens['completion_tokens']:>8} completion tokens")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = report["failed_or_timed_out"] > 0
+    too_slow = (
+        args.max_p95_seconds is not None and "end_to_end" in report["stages"]
+        and report["stages"]["end_to_end"]["p95"] > args.max_p95_seconds
+    )
+    if failed:
+        print(f"FAIL: {report['failed_or_timed_out']} jobs failed or timed out")
+    if too_slow:
+        print(f"FAIL: end-to-end p95 above {args.max_p95_seconds}s")
+    sys.exit(1 if failed or too_slow else 0)
+
+
+if __name__ == "__main__":
+    main()
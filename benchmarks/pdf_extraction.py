@@ -0,0 +1,80 @@
+# Extraction benchmark for large filings: parses a generated text-dense PDF in process and through the extraction pool,
+# cold (the first large document of a worker process starts the pool) and warm (every later one reuses it).
+#
+# Usage (from the repo root):
+#   python benchmarks/pdf_extraction.py --pages 400 --workers 4 --runs 3
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from crew import pdf_extraction  # noqa: E402
+
+# 10-K body pages carry 500-700 words, mostly narrative with some table rows
+LINE = "Revenue increased 12% to $4,182 million driven by services growth, partially offset by lower hardware volumes."
+LINES_PER_PAGE = 48
+
+
+def make_dense_pdf(pages: int) -> bytes:
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(1, pages + 1):
+        text = "".join(f"(Page {page} line {line}: {LINE}) Tj T* " for line in range(LINES_PER_PAGE))
+        stream = f"BT /F1 7 Tf 9 TL 36 756 Td {text}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return body
+
+
+def timed(file_path: str, workers: int) -> float:
+    start = time.perf_counter()
+    pages = list(pdf_extraction.iter_clean_pages(file_path, workers=workers))
+    elapsed = time.perf_counter() - start
+    assert pages, "no pages extracted"
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs pooled page extraction of a large filing")
+    parser.add_argument("--pages", type=int, default=400, help="pages of the generated filing")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction pool size")
+    parser.add_argument("--runs", type=int, default=3, help="runs to take the median of")
+    args = parser.parse_args()
+
+    # every page count takes the pooled path, the threshold itself is what is being measured
+    pdf_extraction.PDF_PARALLEL_PAGE_THRESHOLD = 1
+    with tempfile.TemporaryDirectory(prefix="pdf_extraction_") as workdir:
+        file_path = os.path.join(workdir, "filing.pdf")
+        with open(file_path, "wb") as f:
+            f.write(make_dense_pdf(args.pages))
+
+        serial = statistics.median(timed(file_path, 1) for _ in range(args.runs))
+        cold = timed(file_path, args.workers)
+        warm = statistics.median(timed(file_path, args.workers) for _ in range(args.runs))
+
+    print(f"{args.pages} pages, {os.cpu_count()} CPUs, pool of {args.workers}")
+    print(f"in process     {serial:.3f}s")
+    print(f"pool, cold     {cold:.3f}s (starts the worker process's pool)")
+    print(f"pool, warm     {warm:.3f}s ({serial / warm:.2f}x in process)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,184 @@
-from job_database.job_db import DocumentAnalysisJobDB, DocumentAnalysisJobs
+from job_database.job_db import DocumentAnalysisJobDB, DocumentAnalysisJobs, upload_still_needed
 from crew.crew_utils import run_crew
+from crew.pdf_extraction import load_clean_pages
+from crew.pdf_cache import remember_file_sha256
+from crew.metrics import build_metrics_table
+from crew.chunked_analysis import use_chunked_analysis, run_chunked_financial_analysis
 import os
-from celery import Celery
-from dotenv import load_dotenv
-load_dotenv()
-
-# Fix: Use consistent Redis URL and add proper configuration
-celery_app = Celery(
-    "crewai_tasks", 
-    broker=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
-    backend=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+import shutil
+from celery_jobs.celery_app import (
+    celery_app, ANALYZE_DOCUMENT_TASK, PREPARE_DOCUMENT_TASK, DEFAULT_EXECUTION_MODE, DEFAULT_ANALYSIS_MODE, JOB_MAX_RETRIES, JOB_RETRY_DELAY_SECONDS,
 )
-
-# Add Celery configuration to prevent threading issues
-celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
-    timezone='UTC',
-    enable_utc=True,
-    task_always_eager=False,
-    task_eager_propagates=False,
-    # Worker configuration to prevent threading issues
-    worker_prefetch_multiplier=1,  # Process one task at a time
-    task_acks_late=True,  # Acknowledge task only after completion
-    worker_max_tasks_per_child=1,  # Restart worker after each task to prevent memory leaks
+from celery_jobs.job_events import (
+    publish_job_event, STAGE_STARTED, STAGE_COMPLETED, JOB_RETRYING, JOB_COMPLETED, JOB_FAILED, PARSING_STAGE,
 )
+from celery_jobs.job_metrics import JobMetrics
+# registers the RSS based worker recycling
+import celery_jobs.memory_watchdog  # noqa: F401
+# registers the periodic retention task
+import celery_jobs.retention_worker  # noqa: F401
+
+# checkpoint name of the pre-crew metrics stage, crew tasks use their task names
+METRICS_STAGE = "metrics"
+# stage replaced by the map-reduce analysis in chunked mode
+FINANCIAL_ANALYSIS_STAGE = "financial_analysis"
+
+@celery_app.task(name=PREPARE_DOCUMENT_TASK)
+def prepare_document_task(file_path: str, content_hash: str = None):
+    """
+    Parse a batch document into the shared PDF extraction cache, so every job querying it starts from cached pages.
+
+    Args:
+        file_path: Path to the uploaded PDF file
+        content_hash: SHA-256 of the upload computed by the API while streaming it
+    """
+    try:
+        if content_hash:
+            remember_file_sha256(file_path, content_hash)
+        pages = load_clean_pages(file_path)
+        print(f"Prepared document {file_path} ({len(pages)} pages)")
+    except Exception as e:
+        # the analysis jobs of this document still run (they're chained after this task) and report the error themselves
+        print(f"Encountered Error in preparing the document {file_path}: {e}")
 
-@celery_app.task
-def analyze_document_task(job_id: str, file_path: str, query: str):
+@celery_app.task(name=ANALYZE_DOCUMENT_TASK, bind=True, max_retries=JOB_MAX_RETRIES, default_retry_delay=JOB_RETRY_DELAY_SECONDS)
+def analyze_document_task(
+    self, job_id: str, file_path: str, query: str, bypass_cache: bool = False,
+    execution_mode: str = DEFAULT_EXECUTION_MODE, analysis_mode: str = DEFAULT_ANALYSIS_MODE, content_hash: str = None,
+):
     """
-    Celery task to analyze financial documents in the background
+    Celery task to analyze financial documents in the background.
+    Every finished stage is checkpointed, so a retried or re-run job picks up where the last attempt failed.
     
     Args:
         job_id: Unique job identifier
         file_path: Path to the uploaded PDF file
         query: User's analysis query
+        bypass_cache: Skip the LLM response cache for this job
+        execution_mode: "sequential" or "parallel" scheduling of the crew stages
+        analysis_mode: "standard", "chunked" (map-reduce over document sections) or "auto"
+        content_hash: SHA-256 of the upload computed by the API while streaming it, saves re-hashing the file here
     """
     
     # Initialize database connection
-    Session = DocumentAnalysisJobDB().get_local_session()
+    job_db = DocumentAnalysisJobDB()
+    Session = job_db.get_local_session()
     local_session = Session()
+    job = None
+    metrics = None
+
+    def report_stage(event: str, stage: str):
+        """Record and publish a stage transition, progress reporting never fails the job"""
+        try:
+            if event == STAGE_STARTED:
+                metrics.stage_started(stage)
+                job_db.set_job_stage(job_id, stage)
+            publish_job_event(job_id, event, stage)
+        except Exception as e:
+            print(f"Could not report {event} of stage {stage} for job {job_id}: {e}")
     
     try:
         # Update job status to "Processing"
         job = local_session.query(DocumentAnalysisJobs).filter_by(job_id=job_id).first()
         if not job:
             raise Exception(f"Job {job_id} not found in database")
-        
+
+        # updated_at is the time the job was queued (submitted, re-run or set to Retrying)
+        metrics = JobMetrics(job.job_metrics, queued_at=job.updated_at, retries=self.request.retries)
         job.job_status = "Processing"
         local_session.commit()
-        print(f"Processing job {job_id} - file {file_path}")
+
+        if content_hash and os.path.exists(file_path):
+            remember_file_sha256(file_path, content_hash)
+
+        completed_stages = job_db.get_stage_outputs(job_id)
+        print(f"Processing job {job_id} - file {file_path} (checkpointed stages: {', '.join(completed_stages) or 'none'})")
         
-        # Run the CrewAI analysis
-        crew_result = run_crew(query, file_path)
+        # Pre-crew stage: parse the financial tables so the agents start from exact numbers
+        metrics_table = completed_stages.pop(METRICS_STAGE, None)
+        if metrics_table is None:
+            report_stage(STAGE_STARTED, PARSING_STAGE)
+            usage = {}
+            metrics_table = build_metrics_table(load_clean_pages(file_path, usage))
+            job_db.save_stage_output(job_id, METRICS_STAGE, metrics_table)
+            metrics.stage_completed(PARSING_STAGE, usage)
+            report_stage(STAGE_COMPLETED, PARSING_STAGE)
+
+        # Chunked mode: map-reduce the financial analysis over document sections, the crew then skips that task
+        if FINANCIAL_ANALYSIS_STAGE not in completed_stages:
+            pages = load_clean_pages(file_path)
+            if use_chunked_analysis(pages, analysis_mode):
+                report_stage(STAGE_STARTED, FINANCIAL_ANALYSIS_STAGE)
+                usage = {}
+                financial_analysis = run_chunked_financial_analysis(
+                    pages, query, metrics_table, bypass_cache=bypass_cache, usage=usage, job_id=job_id
+                )
+                job_db.save_stage_output(job_id, FINANCIAL_ANALYSIS_STAGE, financial_analysis)
+                completed_stages[FINANCIAL_ANALYSIS_STAGE] = financial_analysis
+                metrics.stage_completed(FINANCIAL_ANALYSIS_STAGE, usage)
+                report_stage(STAGE_COMPLETED, FINANCIAL_ANALYSIS_STAGE)
+
+        # Run the CrewAI analysis, skipping checkpointed tasks and checkpointing the rest as they finish
+        def on_stage_complete(stage, output, usage):
+            job_db.save_stage_output(job_id, stage, output)
+            metrics.stage_completed(stage, usage)
+            try:
+                job_db.save_job_metrics(job_id, metrics.to_json())
+            except Exception as e:
+                print(f"Could not save metrics of job {job_id}: {e}")
+            report_stage(STAGE_COMPLETED, stage)
+
+        crew_result = run_crew(
+            query, file_path, metrics=metrics_table, bypass_cache=bypass_cache, job_id=job_id,
+            completed_stages=completed_stages, execution_mode=execution_mode,
+            on_stage_complete=on_stage_complete, on_stage_start=lambda stage: report_stage(STAGE_STARTED, stage),
+            on_tool_used=metrics.tool_used, content_hash=content_hash,
+        )
         
         # Update job with results
+        metrics.finish()
         job.job_status = "Completed"
         job.job_result = str(crew_result)
+        job.job_metrics = metrics.to_json()
         local_session.commit()
+        publish_job_event(job_id, JOB_COMPLETED)
         print(f"Job Done: {job_id}")
+
+        # the upload is kept until the job completes, a retry or re-run may still need it, and so may other queries of a batch document
+        if not upload_still_needed(local_session, file_path, job_id):
+            # jobs sharing the upload can finish at the same moment, the first one removes it
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
         
     except Exception as e:
-        # Update job status to failed
         print(f"Encountered Error in processing the job {job_id}: {e}")
+        if job is None:
+            return
+        local_session.rollback()
+        if metrics is not None:
+            metrics.finish()
+            job.job_metrics = metrics.to_json()
+
+        if self.request.retries < self.max_retries:
+            # checkpointed stages are kept, the retry only redoes what didn't finish
+            job.job_status = "Retrying"
+            job.job_result = f"Retrying after error: {str(e)}"
+            local_session.commit()
+            publish_job_event(job_id, JOB_RETRYING, error=str(e))
+            raise self.retry(exc=e)
+
+        # Update job status to failed, it can still be resumed through POST /rerun/{job_id}
         job.job_status = "Failed"
         job.job_result = f"Error: {str(e)}"
         local_session.commit()
+        publish_job_event(job_id, JOB_FAILED, error=str(e))
         
     finally:
-        # cleanup generated output files and file
-        if os.path.exists(file_path): os.remove(file_path)
-
-        outputs_dir = "outputs"
-        if os.path.exists(outputs_dir):
-            for file in os.listdir(outputs_dir):
-                if file.endswith(".txt"):
-                    try:
-                        os.remove(os.path.join(outputs_dir, file))
-                    except Exception:
-                        pass  # Don't raise exceptions in finally block
+        # cleanup this job's own output folder, other jobs' files are left alone
+        # Don't raise exceptions in finally block
+        shutil.rmtree(os.path.join("outputs", job_id), ignore_errors=True)
                 
         # close db session
         local_session.close()
@@ -0,0 +1,100 @@
+# This file only has the Celery app and its configuration, so the API can enqueue jobs by task name
+# without importing the crew stack (crewai, langchain, LLM clients) that the worker needs.
+import os
+from celery import Celery
+from dotenv import load_dotenv
+load_dotenv()
+
+# Registered task names, the API sends work by name through `celery_app.send_task`
+# (kept equal to the name Celery derived from the worker module, so already queued messages still route)
+ANALYZE_DOCUMENT_TASK = "celery_jobs.analysis_worker.analyze_document_task"
+# Expires old jobs, archives large results and sweeps orphaned files (job_database/retention.py), run by Celery beat
+RETENTION_TASK = "celery_jobs.retention_worker.run_retention_task"
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+# Parses a batch document once (into the PDF extraction cache) before the analysis jobs that share it start
+PREPARE_DOCUMENT_TASK = "celery_jobs.analysis_worker.prepare_document_task"
+
+# How the crew stages of a job are scheduled: "sequential" runs the four tasks one after another,
+# "parallel" runs them as a dependency graph (investment advice and risk assessment side by side)
+EXECUTION_MODES = ("sequential", "parallel")
+DEFAULT_EXECUTION_MODE = os.getenv("DEFAULT_EXECUTION_MODE", "sequential")
+
+# How the financial analysis stage reads the document: "standard" lets the agent search it, "chunked" map-reduces
+# token-budgeted sections concurrently (for very large filings) and "auto" picks chunked above CHUNKED_ANALYSIS_MIN_TOKENS
+ANALYSIS_MODES = ("standard", "chunked", "auto")
+DEFAULT_ANALYSIS_MODE = os.getenv("DEFAULT_ANALYSIS_MODE", "standard")
+
+# Model the crew runs on, part of the key identical submissions are coalesced by
+LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-4o")
+# A completed job's result is served to identical submissions for this long, 0 only coalesces jobs still in flight
+DEDUP_FRESHNESS_SECONDS = int(os.getenv("DEDUP_FRESHNESS_SECONDS", "900"))
+
+# Failed jobs are retried this many times, resuming from their last checkpointed stage
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "2"))
+JOB_RETRY_DELAY_SECONDS = int(os.getenv("JOB_RETRY_DELAY_SECONDS", "30"))
+
+# Jobs are routed by the page count the API estimates at upload time, each size class has its own queue and worker pool,
+# so a 400 page annual report never holds up a short earnings release queued behind it. Maintenance tasks stay on Celery's
+# default queue ("celery"), consumed by the small pool.
+QUEUE_CLASSES = ("small", "large")
+LARGE_JOB_MIN_PAGES = int(os.getenv("LARGE_JOB_MIN_PAGES", "50"))
+JOB_QUEUES = {
+    "small": os.getenv("SMALL_JOB_QUEUE", "analysis_small"),
+    "large": os.getenv("LARGE_JOB_QUEUE", "analysis_large"),
+}
+# Worker processes/threads serving each queue, the API's backlog estimate divides the queued work by these
+QUEUE_WORKERS = {
+    "small": int(os.getenv("SMALL_QUEUE_WORKERS", "4")),
+    "large": int(os.getenv("LARGE_QUEUE_WORKERS", "1")),
+}
+# Admission control: a submission is turned away (429 + Retry-After) once its queue's estimated wait would exceed this, 0 disables it
+ADMISSION_MAX_BACKLOG_SECONDS = {
+    "small": int(os.getenv("ADMISSION_MAX_SMALL_BACKLOG_SECONDS", "900")),
+    "large": int(os.getenv("ADMISSION_MAX_LARGE_BACKLOG_SECONDS", "3600")),
+}
+# Time per job assumed until a queue has completed jobs with metrics to average over
+DEFAULT_JOB_SECONDS = {
+    "small": int(os.getenv("DEFAULT_SMALL_JOB_SECONDS", "90")),
+    "large": int(os.getenv("DEFAULT_LARGE_JOB_SECONDS", "600")),
+}
+# Checkpointed stages of a job (the metrics stage and the four crew tasks), a started job counts towards its queue's backlog
+# with the share of them it still has to run
+JOB_STAGE_COUNT = 5
+
+
+def job_queue_class(page_estimate: int) -> str:
+    """Size class of a document, unknown sizes (jobs stored before routing existed) count as small"""
+    return "large" if page_estimate and page_estimate >= LARGE_JOB_MIN_PAGES else "small"
+
+
+# Workers stay warm across jobs and are only recycled once their resident memory grows past this
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "1536"))
+
+# Fix: Use consistent Redis URL and add proper configuration
+celery_app = Celery(
+    "crewai_tasks", 
+    broker=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    backend=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+)
+
+# Add Celery configuration to prevent threading issues
+celery_app.conf.update(
+    task_serializer='json',
+    accept_content=['json'],
+    result_serializer='json',
+    timezone='UTC',
+    enable_utc=True,
+    task_always_eager=False,
+    task_eager_propagates=False,
+    # Worker configuration to prevent threading issues
+    worker_prefetch_multiplier=1,  # Process one task at a time
+    task_acks_late=True,  # Acknowledge task only after completion
+    # Keep workers warm (crewai, agents and tasks are built once per process) and recycle prefork children on memory instead of
+    # after every task; solo/threads pools are covered by the RSS watchdog in celery_jobs/memory_watchdog.py
+    worker_max_memory_per_child=WORKER_MAX_RSS_MB * 1024,  # in KiB
+)
+
+# Periodic maintenance, needs a beat process next to the workers: `celery -A celery_jobs.analysis_worker beat`
+celery_app.conf.beat_schedule = {
+    "job-retention": {"task": RETENTION_TASK, "schedule": RETENTION_INTERVAL_SECONDS},
+}
@@ -0,0 +1,64 @@
+# This file has the job progress events: the worker publishes stage transitions on a Redis pub/sub channel per job
+# and the API relays them to clients over Server-Sent Events, so clients don't have to poll /status/{job_id}
+import json
+import os
+from datetime import datetime, timezone
+import redis
+import redis.asyncio
+from dotenv import load_dotenv
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_EVENTS_CHANNEL_PREFIX = os.getenv("JOB_EVENTS_CHANNEL_PREFIX", "job_events:")
+
+# Event types, a stream ends with one of the terminal ones ("job_retrying" is followed by a new attempt)
+STAGE_STARTED = "stage_started"
+STAGE_COMPLETED = "stage_completed"
+JOB_RETRYING = "job_retrying"
+JOB_COMPLETED = "job_completed"
+JOB_FAILED = "job_failed"
+TERMINAL_EVENTS = (JOB_COMPLETED, JOB_FAILED)
+
+# Stage names in the events: PDF parsing + metrics, then the four crew tasks
+PARSING_STAGE = "parsing"
+
+_redis_client = None
+_async_redis_client = None
+
+
+def job_events_channel(job_id: str) -> str:
+    return f"{JOB_EVENTS_CHANNEL_PREFIX}{job_id}"
+
+
+def publish_job_event(job_id: str, event: str, stage: str = None, **data) -> None:
+    """
+    Publish a progress event of a job, best effort: a lost event never fails the job, /status still has the state.
+
+    Args:
+    job_id (str): Job the event belongs to
+    event (str): One of the event types above
+    stage (str, optional): Stage the event is about, for stage events
+    data: Extra JSON serializable fields, e.g. `error`
+    """
+    global _redis_client
+    payload = {"job_id": job_id, "event": event, "stage": stage, "at": datetime.now(timezone.utc).isoformat(), **data}
+    try:
+        if _redis_client is None:
+            _redis_client = redis.Redis.from_url(REDIS_URL)
+        _redis_client.publish(job_events_channel(job_id), json.dumps(payload))
+    except redis.RedisError as e:
+        print(f"Could not publish {event} event of job {job_id}: {e}")
+
+
+async def subscribe_job_events(job_id: str):
+    """Subscribe to a job's events (before reading its current state, so no transition is missed in between)"""
+    global _async_redis_client
+    if _async_redis_client is None:
+        _async_redis_client = redis.asyncio.Redis.from_url(REDIS_URL)
+    pubsub = _async_redis_client.pubsub()
+    try:
+        await pubsub.subscribe(job_events_channel(job_id))
+    except redis.RedisError:
+        await pubsub.aclose()
+        raise
+    return pubsub
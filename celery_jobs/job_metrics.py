@@ -0,0 +1,84 @@
+# This file has the per job instrumentation of the worker: queue wait, stage timings, token counts, LLM and tool cache hits
+# and retries, accumulated over a job's attempts and stored as JSON in the job row's `job_metrics` column.
+# The API aggregates them over all jobs on GET /metrics.
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+# Usage counters of a stage (see `crew.llm_cache.llm_usage` and `crew.pdf_extraction.load_clean_pages`), also summed into the job totals
+USAGE_FIELDS = (
+    "llm_requests", "prompt_tokens", "completion_tokens", "cached_prompt_tokens", "llm_cache_hits", "llm_cache_misses",
+    "pdf_cache_hits", "pdf_cache_misses",
+)
+
+
+class JobMetrics:
+    """Metrics of one job attempt on top of the ones recorded by earlier attempts. Crew tasks report from their own threads."""
+
+    def __init__(self, previous: str = None, queued_at: datetime = None, retries: int = 0):
+        """
+        Args:
+        previous (str, optional): The job's stored `job_metrics` JSON, stages finished by earlier attempts keep their entries
+        queued_at (datetime, optional): When the job was (re)queued, naive UTC like the job table, the wait until now is queue wait
+        retries (int, optional): Celery retries of the current run so far
+        """
+        self._lock = threading.Lock()
+        self._attempt_started = time.perf_counter()
+        self._finished = False
+        self._stage_started = {}
+        self._stage_tools = {}
+
+        self.data = json.loads(previous) if previous else {}
+        self.data.setdefault("stages", {})
+        self.data.setdefault("tools", {})
+        self.data["attempts"] = self.data.get("attempts", 0) + 1
+        self.data["retries"] = retries
+        if queued_at is not None:
+            queue_wait = max(0.0, (datetime.now(timezone.utc).replace(tzinfo=None) - queued_at).total_seconds())
+            self.data["queue_wait_seconds"] = round(self.data.get("queue_wait_seconds", 0) + queue_wait, 3)
+
+    def stage_started(self, stage: str) -> None:
+        with self._lock:
+            self._stage_started[stage] = time.perf_counter()
+            self._stage_tools[stage] = {"tool_calls": 0, "tool_seconds": 0.0}
+
+    def stage_completed(self, stage: str, usage: dict = None) -> None:
+        """Record a finished stage, `usage` holds its token and response cache counts if it called the LLM"""
+        with self._lock:
+            started = self._stage_started.pop(stage, None)
+            entry = {
+                "seconds": round(time.perf_counter() - started, 3) if started is not None else None,
+                "attempt": self.data["attempts"],
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+            }
+            tools = self._stage_tools.pop(stage, {"tool_calls": 0, "tool_seconds": 0.0})
+            entry.update(tool_calls=tools["tool_calls"], tool_seconds=round(tools["tool_seconds"], 3))
+            entry.update({field: (usage or {}).get(field, 0) for field in USAGE_FIELDS})
+            self.data["stages"][stage] = entry
+
+    def tool_used(self, stage: str, tool_name: str, seconds: float, from_cache: bool) -> None:
+        with self._lock:
+            stage_tools = self._stage_tools.setdefault(stage, {"tool_calls": 0, "tool_seconds": 0.0})
+            stage_tools["tool_calls"] += 1
+            stage_tools["tool_seconds"] += seconds
+            tool = self.data["tools"].setdefault(tool_name, {"calls": 0, "seconds": 0.0, "cache_hits": 0})
+            tool["calls"] += 1
+            tool["seconds"] = round(tool["seconds"] + seconds, 3)
+            tool["cache_hits"] += int(from_cache)
+
+    def finish(self) -> None:
+        """Add the attempt's run time to the job's processing time when the attempt ends (successfully or not), only once"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.data["processing_seconds"] = round(
+                self.data.get("processing_seconds", 0) + time.perf_counter() - self._attempt_started, 3
+            )
+
+    def to_json(self) -> str:
+        with self._lock:
+            stages = self.data["stages"].values()
+            self.data["totals"] = {field: sum(stage.get(field, 0) for stage in stages) for field in USAGE_FIELDS}
+            return json.dumps(self.data)
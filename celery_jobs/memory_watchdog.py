@@ -0,0 +1,41 @@
+# This file has the RSS watchdog that recycles long-lived workers once they grow past WORKER_MAX_RSS_MB,
+# replacing the old restart-after-every-task policy. Prefork children are recycled by Celery itself
+# (`worker_max_memory_per_child`), this covers the solo/threads pools where the worker process runs the tasks.
+import os
+import signal
+from celery.signals import task_postrun, worker_process_init
+
+from celery_jobs.celery_app import WORKER_MAX_RSS_MB
+
+_is_pool_child = False
+
+
+def current_rss_mb() -> float:
+    """Current resident set size of this process in MiB"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # no procfs (e.g. macOS): fall back to the peak RSS, reported in bytes there
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+@worker_process_init.connect
+def _mark_pool_child(**kwargs):
+    global _is_pool_child
+    _is_pool_child = True
+
+
+@task_postrun.connect
+def recycle_on_high_memory(sender=None, task_id=None, **kwargs):
+    """After each task, ask the worker for a warm shutdown if it's over the memory limit, the supervisor starts a fresh one"""
+    if _is_pool_child:
+        return  # Celery's worker_max_memory_per_child handles prefork children
+
+    rss_mb = current_rss_mb()
+    if rss_mb > WORKER_MAX_RSS_MB:
+        print(f"Worker RSS {rss_mb:.0f} MiB exceeds {WORKER_MAX_RSS_MB} MiB after task {task_id}, recycling the worker")
+        # SIGTERM is Celery's warm shutdown: the current task finishes and is acked before the process exits
+        os.kill(os.getpid(), signal.SIGTERM)
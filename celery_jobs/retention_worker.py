@@ -0,0 +1,12 @@
+# This file registers the periodic retention task (old jobs, large results, orphaned uploads) on the worker,
+# the work itself lives in job_database/retention.py so it can also be run once from the command line
+from celery_jobs.celery_app import celery_app, RETENTION_TASK
+from job_database.retention import run_retention
+
+
+@celery_app.task(name=RETENTION_TASK)
+def run_retention_task():
+    """Celery task running one retention sweep of the job database, scheduled by Celery beat"""
+    report = run_retention()
+    print(f"Retention sweep: {report}")
+    return report
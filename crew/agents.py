@@ -1,16 +1,24 @@
 ## Importing libraries and files
+import os
 from dotenv import load_dotenv
 load_dotenv()
-from crewai import LLM
+# LLM wrapped with an exact-match response cache
+from crew.llm_cache import CachedLLM, StubLLM
 
 # fixed Agent import
 from crewai.agent import Agent
 
 # import custom defined tools from tools.py
-from crew.tools import search_tool, ReadPDFTool
+from crew.tools import search_tool, SearchPDFTool
+from celery_jobs.celery_app import LLM_MODEL
 
 ### Loading LLM , it allows for a more flexible LLM options
-llm = LLM(model="openai/gpt-4o")
+# identical prompts (same document, query and upstream context) are answered from the local response cache,
+# LLM_BACKEND=stub swaps the provider for an offline stand-in (see benchmarks/load_test.py)
+llm = StubLLM(model=LLM_MODEL) if os.getenv("LLM_BACKEND", "openai") == "stub" else CachedLLM(model=LLM_MODEL)
+
+# Provider requests per minute per agent, 0 disables the limit (e.g. for the stub LLM in load tests)
+AGENT_MAX_RPM = int(os.getenv("AGENT_MAX_RPM", "1")) or None
 
 # 1. Creating 1st Agent: an Experienced Financial Analyst agent
 financial_analyst=Agent(
@@ -30,10 +38,10 @@ financial_analyst=Agent(
         "Your expertise also includes evaluating company performance across industries and the economic cycles. "
         "You provide clear, objective financial insights that's backed by data and actual facts."
     ),
-    tools=[ReadPDFTool(), search_tool],
+    tools=[SearchPDFTool(), search_tool],
     llm=llm,
     max_iter=1,
-    max_rpm=1,
+    max_rpm=AGENT_MAX_RPM,
     allow_delegation=True  # Allow delegation to other specialists
 )
 
@@ -55,10 +63,10 @@ investment_advisor = Agent(
         "Your recommendations are based on fundamental analysis, market research, and established investment principles. "
         "You avoid market hype and focus on long-term value of investment."
     ),
-    tools=[search_tool],
+    tools=[SearchPDFTool(), search_tool],
     llm=llm,
     max_iter=1,
-    max_rpm=1,
+    max_rpm=AGENT_MAX_RPM,
     allow_delegation=False
 )
 
@@ -77,10 +85,10 @@ risk_assessor = Agent(
         "Your pragmatic approach combines quantitative risk metrics with qualitative risk factors. "
         "You provide objective and clear risk assessments to ensure all potential risks are accounted for and mitigated timely."
     ),
-    tools=[search_tool],
+    tools=[SearchPDFTool(), search_tool],
     llm=llm,
     max_iter=1,
-    max_rpm=1,
+    max_rpm=AGENT_MAX_RPM,
     allow_delegation=False
 )
 
@@ -103,6 +111,6 @@ executive_summarizer = Agent(
     tools=[],  # No tools needed - focuses on synthesis
     llm=llm,
     max_iter=1,
-    max_rpm=1,
+    max_rpm=AGENT_MAX_RPM,
     allow_delegation=False
 )
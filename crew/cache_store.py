@@ -0,0 +1,108 @@
+# This file has a small SQLite key/value store with TTL and size based eviction, shared by the response caches
+# so cached entries survive worker restarts and are visible to every worker process on the host
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteTTLStore:
+    """Key/value store on a local SQLite file with per entry expiry and a max entry count"""
+
+    def __init__(self, db_path: str, table: str, ttl_seconds: float, max_entries: int):
+        """
+        Initialize the store, the database file and table are created on first use.
+
+        Args:
+        db_path (str): Path to the SQLite file, can be shared by several stores using different tables
+        table (str): Table holding this store's entries
+        ttl_seconds (float): Default time to live of an entry
+        max_entries (int): Least recently used entries beyond this count are evicted
+        """
+        self.db_path = db_path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads (or forked processes), so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # WAL lets readers in other workers proceed while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)")
+            # short lived leases so only one process computes a missing entry at a time
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_claims (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        """Return the stored value, or None if it's missing or expired"""
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key: str, value: str, ttl_seconds: float = None) -> None:
+        """Store a value, replacing any previous entry for the key"""
+        conn = self._connection()
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl, now),
+        )
+        # amortize eviction instead of counting rows on every write
+        self._writes += 1
+        if self._writes % 50 == 0:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def try_claim(self, key: str, lease_seconds: float) -> bool:
+        """Take the lease to compute `key`, False if another process holds a live one"""
+        conn = self._connection()
+        now = time.time()
+        # a lease left behind by a dead worker expires instead of blocking everyone forever
+        conn.execute(f"DELETE FROM {self.table}_claims WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            f"INSERT OR IGNORE INTO {self.table}_claims (key, expires_at) VALUES (?, ?)", (key, now + lease_seconds)
+        )
+        return cursor.rowcount == 1
+
+    def release_claim(self, key: str) -> None:
+        self._connection().execute(f"DELETE FROM {self.table}_claims WHERE key = ?", (key,))
+
+    def evict(self) -> None:
+        """Drop expired entries, then the least recently used ones beyond `max_entries`"""
+        conn = self._connection()
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
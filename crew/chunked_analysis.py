@@ -0,0 +1,215 @@
+# This file has the map-reduce analysis mode for very large filings: the cleaned pages are split into token-budgeted sections,
+# sections are analyzed concurrently (bounded) and the partial analyses are reduced into the single financial analysis report
+# that the downstream crew tasks already expect as context
+
+import copy
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+from crewai.agents.agent_builder.utilities.base_token_process import TokenProcess
+from crewai.utilities.token_counter_callback import TokenCalcHandler
+
+from crew.agents import llm, financial_analyst
+from crew.tasks import financial_analysis_task
+from crew.pdf_extraction import format_pages
+from crew.llm_cache import llm_usage
+from crew.text_utils import estimate_tokens
+
+# Section size and parallelism, configurable via env vars
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "6000"))
+CHUNK_MAX_PARALLEL = int(os.getenv("CHUNK_MAX_PARALLEL", "4"))
+# In "auto" mode documents above this estimated size are analyzed chunked
+CHUNKED_ANALYSIS_MIN_TOKENS = int(os.getenv("CHUNKED_ANALYSIS_MIN_TOKENS", "60000"))
+
+
+def use_chunked_analysis(pages, analysis_mode: str) -> bool:
+    """Resolve an analysis mode ("standard", "chunked" or "auto") for a document"""
+    if analysis_mode == "auto":
+        return sum(estimate_tokens(text) for _, text in pages) > CHUNKED_ANALYSIS_MIN_TOKENS
+    return analysis_mode == "chunked"
+
+
+def split_into_sections(pages, token_budget: int = CHUNK_TOKEN_BUDGET):
+    """Group consecutive pages into sections of at most `token_budget` estimated tokens
+
+    Args:
+        pages (list): `[(page_number, cleaned_text), ...]`
+        token_budget (int, optional): Max estimated tokens per section
+
+    Returns:
+        list: sections, each a list of `(page_number, text)`; pages bigger than the budget are split by lines
+    """
+    sections = []
+    current = []
+    current_tokens = 0
+    for page_num, text in pages:
+        # split oversized pages (e.g. dense tables) into budget sized parts that keep their page number
+        parts = [text]
+        if estimate_tokens(text) > token_budget:
+            parts, part, part_tokens = [], [], 0
+            for line in text.split("\n"):
+                line_tokens = estimate_tokens(line)
+                if part and part_tokens + line_tokens > token_budget:
+                    parts.append("\n".join(part))
+                    part, part_tokens = [], 0
+                part.append(line)
+                part_tokens += line_tokens
+            if part:
+                parts.append("\n".join(part))
+
+        for part in parts:
+            part_tokens = estimate_tokens(part)
+            if current and current_tokens + part_tokens > token_budget:
+                sections.append(current)
+                current, current_tokens = [], 0
+            current.append((page_num, part))
+            current_tokens += part_tokens
+
+    if current:
+        sections.append(current)
+    return sections
+
+
+def _system_message() -> dict:
+    return {
+        "role": "system",
+        "content": f"You are a {financial_analyst.role}. {financial_analyst.backstory}",
+    }
+
+
+def _call_llm(section_llm, prompt: str) -> tuple:
+    """One map or reduce call, returns `(response, usage)`
+
+    Calls run on pool threads, so each one counts on its own LLM copy and token counter and the caller sums the usages
+    """
+    call_llm = copy.copy(section_llm)
+    call_llm.cache_hits = call_llm.cache_misses = 0
+    token_process = TokenProcess()
+    response = call_llm.call([_system_message(), {"role": "user", "content": prompt}], callbacks=[TokenCalcHandler(token_process)])
+    return response, llm_usage(token_process, call_llm)
+
+
+def _analyze_section(section_llm, section, query: str, metrics: str, whole_document: bool = False) -> tuple:
+    """Map step: extract the financially relevant facts of one section, returns `(notes, usage)`
+
+    A section holding the `whole_document` is asked for the final report straight away, there is nothing to reduce
+    """
+    first_page, last_page = section[0][0], section[-1][0]
+    if whole_document:
+        scope = f"You are reading the whole financial document (pages {first_page}-{last_page})."
+        expected_output = f"""
+    ### EXPECTED OUTPUT:
+    {financial_analysis_task.expected_output}
+    """
+    else:
+        scope = f"You are reading pages {first_page}-{last_page} of a larger financial document, other sections are analyzed separately."
+        expected_output = ""
+    prompt = f"""
+    {scope}
+
+    ### PRE-EXTRACTED METRICS (exact, parsed from the document's tables):
+    {metrics}
+
+    ### INSTRUCTIONS:
+    1. Extract every key financial figure in these pages (revenue, margins, net income, EPS, cash flow, debt, guidance) with its period
+    2. Note trends, year-over-year changes and management commentary on them
+    3. Note facts relevant to a SWOT analysis (strengths, weaknesses, opportunities, threats)
+    4. Cite page numbers, be concise and only state what the pages support, no investment advice
+    5. Keep in mind the user's query: {query}
+    {expected_output}
+    ### PAGES:
+    {format_pages(section)}
+    """
+    return _call_llm(section_llm, prompt)
+
+
+def _reduce(section_llm, partials, query: str, metrics: str) -> tuple:
+    """Reduce step: merge partial analyses into the report the financial analysis task would have produced, returns `(report, usage)`"""
+    notes = "\n\n".join(f"----------- Section notes {index} ---------------\n{partial}" for index, partial in enumerate(partials, 1))
+    prompt = f"""
+    Below are notes from analyzing consecutive sections of one financial document.
+    Merge them into a single financial analysis, resolving duplicates and keeping the most recent figures.
+
+    ### PRE-EXTRACTED METRICS (exact, parsed from the document's tables, prefer these numbers):
+    {metrics}
+
+    User's query: {query}
+
+    ### EXPECTED OUTPUT:
+    {financial_analysis_task.expected_output}
+
+    ### SECTION NOTES:
+    {notes}
+    """
+    return _call_llm(section_llm, prompt)
+
+
+def run_chunked_financial_analysis(pages, query: str, metrics: str, bypass_cache: bool = False,
+                                   token_budget: int = CHUNK_TOKEN_BUDGET, max_parallel: int = CHUNK_MAX_PARALLEL, usage: dict = None,
+                                   job_id: str = None) -> str:
+    """Map-reduce the financial analysis of a large document
+
+    Args:
+        pages (list): `[(page_number, cleaned_text), ...]` as returned by `load_clean_pages`
+        query (str): User's analysis query
+        metrics (str): Pre-extracted metrics table
+        bypass_cache (bool, optional): Send every LLM call to the provider, ignoring the response cache
+        token_budget (int, optional): Max estimated tokens per section and per reduce batch
+        max_parallel (int, optional): Max sections analyzed at the same time
+        usage (dict, optional): Filled with the token and response cache counts of the run (see `crew.llm_cache.llm_usage`)
+        job_id (str, optional): Also writes the report to the financial analysis task's output file under outputs/{job_id}/, as the crew would
+
+    Returns:
+        str: Financial analysis report, used in place of the financial analysis task's output
+    """
+    # own copy of the shared LLM, so the per job cache bypass doesn't leak to other jobs
+    section_llm = copy.copy(llm)
+    section_llm.bypass_cache = section_llm.bypass_cache or bypass_cache
+    # summed from the calls' own counts (the same token counter the crew agents use), so chunked and crew stages report usage alike
+    run_usage = Counter()
+
+    def collect(results) -> list:
+        responses = []
+        for response, call_usage in results:
+            responses.append(response)
+            run_usage.update(call_usage)
+        return responses
+
+    sections = split_into_sections(pages, token_budget)
+    if len(sections) == 1:
+        # the document fits one section, its map call writes the report and the reduce call is skipped
+        report = collect([_analyze_section(section_llm, sections[0], query, metrics, whole_document=True)])[0]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+            partials = collect(executor.map(lambda section: _analyze_section(section_llm, section, query, metrics), sections))
+
+            # reduce in budget sized batches (concurrently) until one batch holds everything, keeps every prompt bounded
+            while len(partials) > 1:
+                batches, batch, batch_tokens = [], [], 0
+                for partial in partials:
+                    partial_tokens = estimate_tokens(partial)
+                    if batch and batch_tokens + partial_tokens > token_budget:
+                        batches.append(batch)
+                        batch, batch_tokens = [], 0
+                    batch.append(partial)
+                    batch_tokens += partial_tokens
+                batches.append(batch)
+                if len(batches) == 1:
+                    break
+                if len(batches) == len(partials):
+                    # every partial alone fills the budget, pair them up so the reduction still converges
+                    batches = [partials[index:index + 2] for index in range(0, len(partials), 2)]
+                partials = collect(executor.map(lambda batch: _reduce(section_llm, batch, query, metrics), batches))
+
+        report = collect([_reduce(section_llm, partials, query, metrics)])[0]
+
+    if job_id is not None:
+        output_file = financial_analysis_task.output_file.format(job_id=job_id)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(report)
+    if usage is not None:
+        usage.update(run_usage)
+    return report
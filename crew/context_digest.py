@@ -0,0 +1,112 @@
+# This file has the context compaction between chained crew tasks: before a downstream task reads an upstream report as context,
+# the report is condensed into a structured digest under a token budget, so prompts stop growing with every stage.
+# The digest is extractive (no extra LLM call, deterministic so cached downstream prompts still match): headings are kept
+# and each section keeps its most informative lines (figures, recommendations, risks) in their original order.
+# The full reports stay checkpointed with the job (document_analysis_stages, GET /status/{job_id}/stages).
+
+import os
+import re
+from dotenv import load_dotenv
+load_dotenv()
+
+from crew.text_utils import estimate_tokens
+
+# Max estimated tokens of one upstream report as context, 0 passes full reports on
+CONTEXT_DIGEST_TOKEN_BUDGET = int(os.getenv("CONTEXT_DIGEST_TOKEN_BUDGET", "400"))
+
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|\*\*[^*]+\*\*:?|[A-Z][^.!?]{0,60}:)$")
+_BULLET_RE = re.compile(r"^([-*•]|\d+[.)])\s+")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9$(])")
+_FIGURE_RE = re.compile(r"\d")
+_KEY_TERMS_RE = re.compile(
+    r"\b(recommend\w*|buy|hold|sell|target|rating|risk\w*|growth|grew|decline\w*|margin\w*|revenue|income|earnings|eps|"
+    r"cash flow|debt|guidance|outlook|strength\w*|weakness\w*|opportunit\w*|threat\w*|valuation|liquidity|mitigat\w*)\b",
+    re.IGNORECASE,
+)
+
+
+def _score(unit: str) -> int:
+    """How much a line or sentence is worth keeping: figures first, then the terms downstream stages reason about"""
+    score = 3 * bool(_FIGURE_RE.search(unit)) + 2 * bool(_KEY_TERMS_RE.search(unit)) + bool(_BULLET_RE.match(unit))
+    return score - 2 if len(unit.split()) < 4 else score
+
+
+def _split_sections(text: str) -> list:
+    """`[(heading or None, [unit, ...]), ...]`, units are lines, and sentences of long lines"""
+    sections = [(None, [])]
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if _HEADING_RE.match(line) and not _BULLET_RE.match(line):
+            sections.append((line, []))
+            continue
+        bullet = _BULLET_RE.match(line)
+        prefix, body = (bullet.group(0), line[bullet.end():]) if bullet else ("", line)
+        sentences = _SENTENCE_SPLIT_RE.split(body) if estimate_tokens(body) > 60 else [body]
+        sections[-1][1].extend([prefix + sentences[0]] + sentences[1:])
+    return [section for section in sections if section[0] or section[1]]
+
+
+def digest_report(stage: str, text: str, token_budget: int = CONTEXT_DIGEST_TOKEN_BUDGET) -> str:
+    """Condense a task's report into a structured digest of at most ~`token_budget` estimated tokens
+
+    Args:
+        stage (str): Task name the report comes from, named in the digest header
+        text (str): The full report
+        token_budget (int, optional): Max estimated tokens of the digest, 0 returns the report unchanged
+
+    Returns:
+        str: The report itself if it fits the budget, otherwise its digest
+    """
+    total_tokens = estimate_tokens(text)
+    if not token_budget or total_tokens <= token_budget:
+        return text
+
+    sections = _split_sections(text)
+    candidates = [
+        (section_index, unit_index, unit)
+        for section_index, (_, units) in enumerate(sections)
+        for unit_index, unit in enumerate(units)
+    ]
+    ranked = sorted(candidates, key=lambda candidate: (-_score(candidate[2]), candidate[0], candidate[1]))
+    # every section's best unit first, so no part of the report drops out entirely, then the best of the rest
+    best_per_section = {}
+    for candidate in ranked:
+        best_per_section.setdefault(candidate[0], candidate)
+    ordered = sorted(best_per_section.values(), key=lambda candidate: candidate[0]) + ranked
+
+    selected = set()
+    seen = set()
+    used_sections = set()
+    used_tokens = 0
+    for section_index, unit_index, unit in ordered:
+        normalized = " ".join(unit.lower().split())
+        if (section_index, unit_index) in selected or normalized in seen:
+            continue
+        heading = sections[section_index][0]
+        cost = estimate_tokens(unit) + (estimate_tokens(heading) if heading and section_index not in used_sections else 0)
+        if used_tokens + cost > token_budget:
+            continue
+        selected.add((section_index, unit_index))
+        seen.add(normalized)
+        used_sections.add(section_index)
+        used_tokens += cost
+
+    lines = []
+    for section_index, (heading, units) in enumerate(sections):
+        if section_index not in used_sections:
+            continue
+        if heading:
+            lines.append(heading)
+        lines.extend(
+            unit if _BULLET_RE.match(unit) else f"- {unit}"
+            for unit_index, unit in enumerate(units) if (section_index, unit_index) in selected
+        )
+    if not lines:
+        # a single unit larger than the whole budget
+        lines.append(text[:token_budget * 4])
+        used_tokens = token_budget
+
+    header = f"[Digest of the {stage} report: ~{used_tokens} of ~{total_tokens} tokens kept, the full report is stored with the job]"
+    return "\n".join([header] + lines)
@@ -1,20 +1,255 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 from crewai import Crew, Process
+from crewai.tasks.task_output import TaskOutput
+from crewai.utilities.events import crewai_event_bus, TaskStartedEvent, ToolUsageFinishedEvent
 from crew.agents import financial_analyst, investment_advisor, risk_assessor, executive_summarizer
 from crew.tasks import financial_analysis_task, investment_analysis_task, risk_assessment_task, executive_summary_task
+from crew.llm_cache import llm_usage, document_cache_key
+from crew.pdf_cache import cached_file_sha256
+from crew.context_digest import digest_report
 
-def run_crew(query: str, file_path: str="data/sample.pdf"):
-    """To run the whole crew"""
-    try:
-        financial_crew = Crew(
-            agents=[financial_analyst, investment_advisor, risk_assessor, executive_summarizer],
-            tasks=[financial_analysis_task, investment_analysis_task, risk_assessment_task, executive_summary_task],
-            process=Process.sequential,
+# Built once per worker process, every job runs on its own copy (fresh agents, tasks and crew state)
+# so long-lived workers don't leak task outputs or interpolated prompts from one job into the next
+crew_template = Crew(
+    agents=[financial_analyst, investment_advisor, risk_assessor, executive_summarizer],
+    tasks=[financial_analysis_task, investment_analysis_task, risk_assessment_task, executive_summary_task],
+    process=Process.sequential,
+)
+
+# Stage dependency graph per execution mode (task name -> task names whose output it needs).
+# "sequential" keeps the contexts defined in crew/tasks.py and runs tasks one by one.
+# "parallel" lets the risk assessment work from the financial analysis alone, so it runs next to the investment advice
+# and the executive summary joins both.
+STAGE_DEPENDENCIES = {
+    "sequential": None,
+    "parallel": {
+        "financial_analysis": [],
+        "investment_analysis": ["financial_analysis"],
+        "risk_assessment": ["financial_analysis"],
+        "executive_summary": ["financial_analysis", "investment_analysis", "risk_assessment"],
+    },
+}
+
+# How a stage's output is named in the prompts of the stages reading it. Prompts name their inputs through `{<stage>_context}`
+# placeholders, so a stage whose context is trimmed in some mode isn't told to use reports it doesn't get
+STAGE_OUTPUT_NAMES = {
+    "financial_analysis": "financial analysis",
+    "investment_analysis": "investment recommendations",
+    "risk_assessment": "risk assessment",
+}
+
+
+def _context_inputs(execution_mode: str) -> dict:
+    """`{"<stage>_context": "financial analysis and investment recommendations", ...}` prompt inputs for an execution mode,
+    stages without context get none"""
+    dependencies = STAGE_DEPENDENCIES[execution_mode] or {
+        task.name: [upstream.name for upstream in task.context] if isinstance(task.context, list) else []
+        for task in crew_template.tasks
+    }
+    inputs = {}
+    for stage, upstreams in dependencies.items():
+        names = [STAGE_OUTPUT_NAMES[upstream] for upstream in upstreams]
+        if names:
+            inputs[f"{stage}_context"] = " and ".join([", ".join(names[:-1]), names[-1]] if len(names) > 1 else names)
+    return inputs
+
+# A wave of parallel stages that hasn't finished after this long fails the job attempt (it's retried from its checkpoints)
+PARALLEL_WAVE_TIMEOUT_SECONDS = float(os.getenv("PARALLEL_WAVE_TIMEOUT_SECONDS", "1800"))
+
+# crewai's event bus is process wide, a job's hooks are looked up by its own task copies (id(task) -> (stage, on_start, on_tool_used))
+_stage_hooks = {}
+_stage_hooks_lock = threading.Lock()
+
+def _get_stage_hooks(task):
+    with _stage_hooks_lock:
+        return _stage_hooks.get(id(task))
+
+@crewai_event_bus.on(TaskStartedEvent)
+def _on_task_started(source, event):
+    hooks = _get_stage_hooks(source)
+    if hooks is not None and hooks[1] is not None:
+        hooks[1](hooks[0])
+
+@crewai_event_bus.on(ToolUsageFinishedEvent)
+def _on_tool_used(source, event):
+    hooks = _get_stage_hooks(getattr(source, "task", None))
+    if hooks is not None and hooks[2] is not None:
+        hooks[2](hooks[0], event.tool_name, (event.finished_at - event.started_at).total_seconds(), event.from_cache)
+
+def _schedule_as_dag(tasks: list, all_tasks: list, dependencies: dict) -> list:
+    """Group the remaining tasks in dependency waves, the tasks of a wave only need outputs of earlier waves
+
+    Args:
+        tasks (list): Tasks that still have to run
+        all_tasks (list): Every task of the job crew, including ones restored from checkpoints
+        dependencies (dict): task name -> names of the tasks it depends on
+
+    Returns:
+        list: waves (lists of tasks) in execution order
+    """
+    by_name = {task.name: task for task in all_tasks}
+    for task in all_tasks:
+        task.context = [by_name[name] for name in dependencies.get(task.name, [])]
+
+    # checkpointed tasks count as already done
+    done = {task.name for task in all_tasks} - {task.name for task in tasks}
+    pending = list(tasks)
+    waves = []
+    while pending:
+        wave = [task for task in pending if set(dependencies.get(task.name, [])) <= done]
+        if not wave:
+            raise ValueError(f"Stage dependency cycle between: {', '.join(task.name for task in pending)}")
+        waves.append(wave)
+        done.update(task.name for task in wave)
+        pending = [task for task in pending if task not in wave]
+    return waves
+
+def _finish_stage(output, stage: str, agent, on_stage_complete, context_stages: set):
+    """Task callback: checkpoint the full output, then compact it if later tasks read it as context"""
+    if on_stage_complete is not None:
+        on_stage_complete(stage, output.raw, llm_usage(agent._token_process, agent.llm))
+    # downstream tasks read `task.output.raw` as context, crewai still writes the full output to the task's output file
+    if stage in context_stages:
+        output.raw = digest_report(stage, output.raw)
+
+def _build_job_crews(completed_stages: dict, on_stage_complete=None, execution_mode: str="sequential", bypass_cache: bool=False, on_stage_start=None, on_tool_used=None, document_keys: dict=None) -> list:
+    """Copy the template crew for one job, dropping the stages that already have a checkpointed output
+
+    Args:
+        completed_stages (dict): `{task name: raw output}` of stages finished by an earlier attempt
+        on_stage_complete (callable, optional): Called as `on_stage_complete(stage, raw_output, usage)` when a remaining task finishes,
+            `usage` holds the token and response cache counts of its agent (see `crew.llm_cache.llm_usage`)
+        execution_mode (str, optional): One of STAGE_DEPENDENCIES
+        bypass_cache (bool, optional): Send every LLM call of this job to the provider
+        on_stage_start (callable, optional): Called as `on_stage_start(stage)` when a remaining task starts
+        on_tool_used (callable, optional): Called as `on_tool_used(stage, tool_name, seconds, from_cache)` after each tool call of a task
+        document_keys (dict, optional): `{file_path: cache key}` of the job's document, see `crew.llm_cache.CachedLLM.document_keys`
+
+    Returns:
+        list: steps to run in order, each a list of crews that run concurrently. Sequential mode is a single crew with the
+        remaining tasks, parallel mode a crew per task grouped in dependency waves. Completed tasks still feed their output
+        (digested, see `crew.context_digest`) to later tasks as context
+    """
+    if execution_mode not in STAGE_DEPENDENCIES:
+        raise ValueError(f"Unknown execution mode {execution_mode}, expected one of {', '.join(STAGE_DEPENDENCIES)}")
+
+    job_crew = crew_template.copy()
+    # copied agents get their own shallow copy of the LLM, so the flag stays per job and holds in the threads async tasks run in.
+    # Each agent runs one task, so its token counter and LLM cache counters are that stage's usage
+    for agent in job_crew.agents:
+        agent.llm.bypass_cache = agent.llm.bypass_cache or bypass_cache
+        agent.llm.cache_hits = agent.llm.cache_misses = 0
+        agent.llm.document_keys = document_keys or {}
+
+    dependencies = STAGE_DEPENDENCIES[execution_mode]
+    # stages some later stage reads as context, filled in once the dependencies are final
+    context_stages = set()
+    remaining_tasks = []
+    for task in job_crew.tasks:
+        if task.name in completed_stages:
+            # downstream tasks read context from `task.output`, so a restored output is all they need
+            task.output = TaskOutput(
+                name=task.name,
+                description=task.description,
+                raw=completed_stages[task.name],
+                agent=task.agent.role,
+            )
+            continue
+        task.callback = lambda output, stage=task.name, agent=task.agent: _finish_stage(
+            output, stage, agent, on_stage_complete, context_stages
         )
-        
-        result = financial_crew.kickoff(inputs={'query': query, 'file_path' : file_path})
+        if on_stage_start is not None or on_tool_used is not None:
+            with _stage_hooks_lock:
+                _stage_hooks[id(task)] = (task.name, on_stage_start, on_tool_used)
+        remaining_tasks.append(task)
+
+    waves = None
+    if dependencies is not None and remaining_tasks:
+        waves = _schedule_as_dag(remaining_tasks, job_crew.tasks, dependencies)
+
+    context_stages.update(
+        upstream.name for task in job_crew.tasks if isinstance(task.context, list) for upstream in task.context
+    )
+    for task in job_crew.tasks:
+        if task.name in completed_stages and task.name in context_stages:
+            task.output.raw = digest_report(task.name, task.output.raw)
+
+    if not remaining_tasks:
+        return []
+    if waves is None:
+        if len(remaining_tasks) == len(job_crew.tasks):
+            return [[job_crew]]
+        return [[Crew(agents=job_crew.agents, tasks=remaining_tasks, process=job_crew.process)]]
+    # one single task crew per stage, so the stages of a wave can run side by side (see `_run_wave`)
+    return [[Crew(agents=[task.agent], tasks=[task], process=job_crew.process) for task in wave] for wave in waves]
+
+def _run_wave(crews: list, inputs: dict, timeout: float):
+    """Run the single task crews of a dependency wave side by side, returns the last crew's result
+
+    The stages run in our own threads rather than as crewai async tasks: crewai's async task thread never hands an exception
+    back, so a failing stage would leave `kickoff` waiting forever. Here the first failure (or the timeout) is raised right away.
+    """
+    if len(crews) == 1:
+        return crews[0].kickoff(inputs=inputs)
+
+    executor = ThreadPoolExecutor(max_workers=len(crews))
+    try:
+        futures = [executor.submit(crew.kickoff, inputs=inputs) for crew in crews]
+        done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        if pending:
+            raise TimeoutError(f"Stages still running after {timeout:.0f}s: {', '.join(crew.tasks[0].name for crew, future in zip(crews, futures) if future in pending)}")
+        return futures[-1].result()
+    finally:
+        # a stage still running after a failure or timeout is abandoned, the job fails (or retries) without waiting for it
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def run_crew(query: str, file_path: str="data/sample.pdf", metrics: str="No structured financial metrics were provided.", bypass_cache: bool=False, job_id: str="local", completed_stages: dict=None, on_stage_complete=None, execution_mode: str="sequential", on_stage_start=None, on_tool_used=None, content_hash: str=None):
+    """To run the whole crew
+
+    Args:
+        query (str): User's analysis query
+        file_path (str, optional): Path of the pdf file. Defaults to "data/sample.pdf".
+        metrics (str, optional): Pre-extracted metrics table from `crew.metrics.build_metrics_table`
+        bypass_cache (bool, optional): Send every LLM call to the provider, ignoring the response cache
+        job_id (str, optional): Namespaces the task output files under outputs/{job_id}/
+        completed_stages (dict, optional): `{task name: raw output}` checkpoints of an earlier attempt, those tasks are skipped
+        on_stage_complete (callable, optional): Called as `on_stage_complete(stage, raw_output, usage)` after each task, to checkpoint it
+        execution_mode (str, optional): "sequential" or "parallel" (dependency graph, independent stages run concurrently)
+        on_stage_start (callable, optional): Called as `on_stage_start(stage)` when a task starts, to report progress
+        on_tool_used (callable, optional): Called as `on_tool_used(stage, tool_name, seconds, from_cache)` after each tool call
+        content_hash (str, optional): SHA-256 of the document, stands in for its per job path in LLM cache keys. Hashed from the file if not given
+    """
+    steps = []
+    try:
+        completed_stages = completed_stages or {}
+        if content_hash is None and os.path.exists(file_path):
+            content_hash = cached_file_sha256(file_path)
+        document_keys = {file_path: document_cache_key(content_hash)} if content_hash else {}
+        steps = _build_job_crews(completed_stages, on_stage_complete, execution_mode, bypass_cache, on_stage_start, on_tool_used, document_keys)
+
+        # every stage was checkpointed already, the last one is the final report
+        final_stage = crew_template.tasks[-1].name
+        if final_stage in completed_stages:
+            return completed_stages[final_stage]
+
+        inputs = {'query': query, 'file_path' : file_path, 'metrics': metrics, 'job_id': job_id, **_context_inputs(execution_mode)}
+        result = None
+        for crews in steps:
+            result = _run_wave(crews, inputs, PARALLEL_WAVE_TIMEOUT_SECONDS)
         return result
-    
+
     except AttributeError as ae:
         raise AttributeError(f"Attribute Error in run_crew: {ae}")
     except Exception as e:
-        raise Exception(f"Error in run_crew: {e}")
\ No newline at end of file
+        raise Exception(f"Error in run_crew: {e}")
+    finally:
+        with _stage_hooks_lock:
+            for crews in steps:
+                for crew in crews:
+                    for task in crew.tasks:
+                        _stage_hooks.pop(id(task), None)
@@ -0,0 +1,182 @@
+# This file has an exact-match response cache around the crew's LLM, so re-runs and retried jobs with identical prompts
+# are served from a local SQLite store instead of going to the provider again
+
+import hashlib
+import json
+import os
+import re
+import time
+from types import SimpleNamespace
+from dotenv import load_dotenv
+load_dotenv()
+from crewai import LLM
+
+from crew.cache_store import SQLiteTTLStore
+
+# Cache location and limits, configurable via env vars
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "cache/responses.db")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+# Completion params that don't change the response, left out of the key
+_NON_KEY_PARAMS = {"messages", "api_key", "timeout", "stream", "callbacks"}
+_WHITESPACE_RE = re.compile(r"\s+")
+# Where the stub LLM looks for the document to search when it isn't told the job's document
+_STUB_PDF_PATH_RE = re.compile(r"[\w./\\:-]+\.pdf\b", re.IGNORECASE)
+
+
+def document_cache_key(content_hash: str) -> str:
+    """What a job's document path is replaced with in cache keys, see `CachedLLM.document_keys`"""
+    return f"pdf-sha256:{content_hash}"
+
+
+def _paths_to_keys(text: str, document_keys: dict) -> str:
+    for path, key in document_keys.items():
+        text = text.replace(path, key)
+    return text
+
+
+def _keys_to_paths(text: str, document_keys: dict) -> str:
+    for path, key in document_keys.items():
+        text = text.replace(key, path)
+    return text
+
+
+def _normalize_text(text: str, document_keys: dict) -> str:
+    return _WHITESPACE_RE.sub(" ", _paths_to_keys(text, document_keys)).strip()
+
+
+def llm_usage(token_process, llm) -> dict:
+    """Token and response cache counts of one agent (or chunked analysis) run, as stored in the job metrics
+
+    Args:
+        token_process (TokenProcess): crewai's per-agent token counter, fed by the LLM call callbacks
+        llm (LLM): The LLM the run used, its cache counters are included when it's a `CachedLLM`
+    """
+    summary = token_process.get_summary()
+    return {
+        "llm_requests": summary.successful_requests,
+        "prompt_tokens": summary.prompt_tokens,
+        "completion_tokens": summary.completion_tokens,
+        "cached_prompt_tokens": summary.cached_prompt_tokens,
+        "llm_cache_hits": getattr(llm, "cache_hits", 0),
+        "llm_cache_misses": getattr(llm, "cache_misses", 0),
+    }
+
+
+class CachedLLM(LLM):
+    """crewai LLM whose plain text completions are cached by model + normalized messages + parameters"""
+
+    def __init__(self, model: str, cache_store: SQLiteTTLStore = None, bypass_cache: bool = not LLM_CACHE_ENABLED, **kwargs):
+        """
+        Args:
+        model (str): Model name, same as for `crewai.LLM`
+        cache_store (SQLiteTTLStore, optional): Where responses are kept, defaults to the `llm_responses` table of LLM_CACHE_DB_PATH
+        bypass_cache (bool, optional): Always call the provider, set per job on the agents' LLM copies by `run_crew`
+        """
+        super().__init__(model=model, **kwargs)
+        self.cache_store = cache_store or SQLiteTTLStore(
+            LLM_CACHE_DB_PATH, "llm_responses", LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES
+        )
+        self.bypass_cache = bypass_cache
+        # upload paths are unique per job, `run_crew` maps the job's exact path to its content hash on the agents' LLM copies,
+        # so identical documents share entries
+        self.document_keys = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cache_key(self, messages, tools=None) -> str:
+        """Hash of the model, the normalized messages and every parameter that affects the completion"""
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        params = self._prepare_completion_params(messages, tools)
+        normalized = {
+            "messages": [
+                {"role": message.get("role"), "content": _normalize_text(str(message.get("content", "")), self.document_keys)}
+                for message in messages
+            ],
+            "params": {key: value for key, value in params.items() if key not in _NON_KEY_PARAMS},
+        }
+        blob = json.dumps(normalized, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        # native function calling executes tools inside the call, so those responses are never cached
+        if self.bypass_cache or available_functions:
+            return self._complete(messages, tools, callbacks, available_functions)
+
+        key = self.cache_key(messages, tools)
+        cached = self.cache_store.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return _keys_to_paths(cached, self.document_keys)
+
+        self.cache_misses += 1
+        response = self._complete(messages, tools, callbacks, available_functions)
+        if isinstance(response, str) and response.strip():
+            # stored with the document key too (e.g. a tool call's file_path), a hit from another job gets that job's path back
+            self.cache_store.set(key, _paths_to_keys(response, self.document_keys))
+        return response
+
+    def _complete(self, messages, tools, callbacks, available_functions):
+        """The provider call behind the cache"""
+        return super().call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions)
+
+
+_STUB_FILLER = (
+    "Revenue grew year over year while operating margin held steady, free cash flow covered capital expenditure "
+    "and the balance sheet kept net cash, so the outlook stays balanced between growth and execution risk. "
+).split()
+
+
+class StubLLM(CachedLLM):
+    """Offline stand-in for the provider with configurable latency and output size, for local runs and benchmarks.
+
+    Agents that have the Search PDF Tool first search the task's document `tool_calls` times (so parsing, retrieval and the
+    tool loop are exercised), then give a final answer of about `output_tokens` tokens. Responses still go through the cache.
+    """
+
+    def __init__(self, model: str, latency_seconds: float = None, output_tokens: int = None, tool_calls: int = None, **kwargs):
+        """
+        Args:
+        model (str): Model name, only used in cache keys
+        latency_seconds (float, optional): Sleep per call, defaults to STUB_LLM_LATENCY_SECONDS (0.5)
+        output_tokens (int, optional): Approximate final answer size, defaults to STUB_LLM_OUTPUT_TOKENS (300)
+        tool_calls (int, optional): Search PDF Tool calls before answering, defaults to STUB_LLM_TOOL_CALLS (1)
+        """
+        super().__init__(model=model, **kwargs)
+        self.latency_seconds = float(os.getenv("STUB_LLM_LATENCY_SECONDS", "0.5")) if latency_seconds is None else latency_seconds
+        self.output_tokens = int(os.getenv("STUB_LLM_OUTPUT_TOKENS", "300")) if output_tokens is None else output_tokens
+        self.tool_calls = int(os.getenv("STUB_LLM_TOOL_CALLS", "1")) if tool_calls is None else tool_calls
+        self.calls = 0
+
+    def _complete(self, messages, tools, callbacks, available_functions):
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        self.calls += 1
+
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        response = self._stub_response(messages, prompt)
+        # report usage to the token callbacks like a provider response would, so job metrics see stub tokens too
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4 + 1, completion_tokens=len(response) // 4 + 1, prompt_tokens_details=None)
+        for callback in callbacks or []:
+            if hasattr(callback, "log_success_event"):
+                callback.log_success_event(kwargs={}, response_obj={"usage": usage}, start_time=0, end_time=0)
+        return response
+
+    def _stub_response(self, messages, prompt: str) -> str:
+        observations = sum("\nObservation:" in str(message.get("content", "")) for message in messages if message.get("role") == "assistant")
+        document = next(iter(self.document_keys), None)
+        if document is None:
+            match = _STUB_PDF_PATH_RE.search(prompt)
+            document = match.group(0) if match else None
+        if "Tool Name: Search PDF Tool" in prompt and document and observations < self.tool_calls:
+            action_input = json.dumps({"file_path": document, "query": "revenue net income cash flow guidance"})
+            return f"Thought: I need figures from the document\nAction: Search PDF Tool\nAction Input: {action_input}"
+
+        # ~0.75 words per token
+        words = [_STUB_FILLER[index % len(_STUB_FILLER)] for index in range(max(1, int(self.output_tokens * 0.75)))]
+        return f"Thought: I now know the final answer\nFinal Answer: {' '.join(words)}"
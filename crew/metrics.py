@@ -0,0 +1,281 @@
+# This file has the deterministic pre-crew metrics stage: it detects financial tables in the cleaned pages,
+# parses their numeric cells into NumPy columns and computes YoY growth and margins, so the LLM gets exact numbers in a few hundred tokens
+
+import re
+import numpy as np
+
+# "per share", "per diluted share", "per basic common share"
+_PER_SHARE_RE = re.compile(r"\bper (?:basic |diluted )?(?:common )?share\b")
+
+# canonical line item -> label matcher, checked in order so the more specific ones win
+LINE_ITEMS = {
+    "EPS (diluted)": lambda label: "diluted" in label and "share" not in _PER_SHARE_RE.sub("", label),
+    "EPS (basic)": lambda label: "basic" in label and "share" not in _PER_SHARE_RE.sub("", label),
+    "Operating Cash Flow": lambda label: "net cash provided by" in label and "operating activities" in label,
+    "Free Cash Flow": lambda label: label.startswith("free cash flow"),
+    "Revenue": lambda label: re.fullmatch(r"(total )?(net )?(revenues?|sales)", label) is not None,
+    "Gross Profit": lambda label: label.startswith("gross profit"),
+    "Operating Income": lambda label: re.match(r"(total )?(income|loss|income \(loss\)) from operations|operating (income|profit|loss)", label) is not None,
+    "Net Income": lambda label: re.match(r"net (income|earnings|profit|loss)", label) is not None
+        and _PER_SHARE_RE.search(label) is None and "noncontrolling" not in label,
+}
+
+# Order rows are shown in, top-line first
+DISPLAY_ORDER = (
+    "Revenue", "Gross Profit", "Operating Income", "Net Income",
+    "EPS (basic)", "EPS (diluted)", "Operating Cash Flow", "Free Cash Flow",
+)
+
+# Items that get a margin row (item / revenue)
+MARGIN_ITEMS = ("Gross Profit", "Operating Income", "Net Income", "Free Cash Flow")
+
+# "Q3 2024", "Q3 FY25", "FY2024", "2023"
+_PERIOD_RE = re.compile(r"\b(?:Q([1-4])\s*(?:FY\s*)?'?(\d{4}|\d{2})|(?:FY\s*)?((?:19|20)\d{2}))\b", re.IGNORECASE)
+# "$1,234.5", "(1,234)", "-12", or a dash standing for an empty cell
+_CELL_RE = re.compile(r"\(?-?\$?\d[\d,]*(?:\.\d+)?\)?%?|(?<!\w)[—–](?!\w)")
+_LABEL_RE = re.compile(r"[^a-z() ]+")
+# column group spans above the periods, "Three Months Ended", "Nine months ended", "Year Ended", "Quarter Ended"
+_SPAN_RE = re.compile(r"\b(three|six|nine|twelve|3|6|9|12)[ -]months?\s+ended|\b(quarter|fiscal year|year)\s+ended", re.IGNORECASE)
+_SPAN_LABELS = {"three": "3M", "3": "3M", "six": "6M", "6": "6M", "nine": "9M", "9": "9M", "twelve": "12M", "12": "12M",
+                "quarter": "3M", "year": "FY", "fiscal year": "FY"}
+# lines above a header line searched for its spans
+_SPAN_LOOKBACK = 3
+
+
+def _parse_period(match: re.Match):
+    """(label, year, quarter) of a period token, quarter is None for full years"""
+    if match.group(3):
+        year = int(match.group(3))
+        return str(year), year, None
+    quarter = int(match.group(1))
+    year = int(match.group(2))
+    if year < 100:
+        year += 2000
+    return f"Q{quarter} {year}", year, quarter
+
+
+def _parse_cell(cell: str) -> float:
+    if cell in ("—", "–"):
+        return np.nan
+    negative = cell.startswith("(") and cell.endswith(")") or cell.startswith("-")
+    value = float(cell.strip("()$-%").replace("$", "").replace(",", ""))
+    return -value if negative else value
+
+
+def _normalize_label(label: str) -> str:
+    return " ".join(_LABEL_RE.sub(" ", label.lower()).split())
+
+
+def _match_line_item(label: str):
+    for item, matcher in LINE_ITEMS.items():
+        if matcher(label):
+            return item
+    return None
+
+
+def _header_periods(line: str):
+    """Periods of a table header line, or None if the line isn't a header"""
+    periods = [_parse_period(match) for match in _PERIOD_RE.finditer(line)]
+    if len(periods) < 2:
+        return None
+    # a header is mostly period tokens (plus e.g. "September 30,"), a data row mentioning two years isn't one
+    for cell in _CELL_RE.findall(_PERIOD_RE.sub("", line)):
+        if cell in ("—", "–") or not cell.rstrip(",").isdigit() or int(cell.rstrip(",")) > 31:
+            return None
+    return periods
+
+
+def _column_groups(periods, spans):
+    """Header group of every column, columns only compare with columns of their own group
+
+    The spans found above the header split the columns into equal blocks ("Three Months Ended" over the first half,
+    "Nine Months Ended" over the second). Without spans a repeating run of periods (2024 2023 2024 2023) marks the blocks.
+
+    Returns:
+        list: `(group index, span label or None)` per column
+    """
+    count = len(periods)
+    if spans and count % len(spans) == 0:
+        width = count // len(spans)
+        return [(column // width, spans[column // width]) for column in range(count)]
+    for width in range(1, count):
+        if count % width == 0 and all(periods[column] == periods[column % width] for column in range(count)):
+            return [(column // width, None) for column in range(count)]
+    return [(0, None)] * count
+
+
+def _header_spans(lines, index: int):
+    """Span labels ("3M", "9M", "FY") of the header at `lines[index]`, from the header line and the lines right above it"""
+    start = index
+    while start > max(0, index - _SPAN_LOOKBACK) and _header_periods(lines[start - 1]) is None:
+        start -= 1
+    spans = []
+    for line in lines[start:index + 1]:
+        for match in _SPAN_RE.finditer(line):
+            spans.append(_SPAN_LABELS[(match.group(1) or match.group(2)).lower()])
+        if spans:
+            # a span line lists all of the header's spans, the ones above it belong to something else
+            break
+    return spans
+
+
+def _parse_tables(pages, max_rows: int = 80):
+    """Yield `(page_number, periods, {item: [values]})` for every table with at least one known line item,
+    periods are `(label, year, quarter, group)` with the header group (span) of the column"""
+    for page_num, text in pages:
+        lines = text.split("\n")
+        index = 0
+        while index < len(lines):
+            periods = _header_periods(lines[index])
+            index += 1
+            if periods is None:
+                continue
+            groups = _column_groups(periods, _header_spans(lines, index - 1))
+            periods = [
+                (f"{span} {label}" if span else label, year, quarter, group)
+                for (label, year, quarter), (group, span) in zip(periods, groups)
+            ]
+
+            rows = {}
+            for line in lines[index:index + max_rows]:
+                if _header_periods(line) is not None:
+                    break  # next table starts
+                cells = list(_CELL_RE.finditer(line))
+                if len(cells) < len(periods):
+                    continue
+                # trailing cells are the period columns, anything before them is the label (incl. note refs)
+                cells = cells[-len(periods):]
+                if any(cell.group(0).endswith("%") for cell in cells):
+                    continue  # ratio rows are recomputed below
+                item = _match_line_item(_normalize_label(line[:cells[0].start()]))
+                if item is not None and item not in rows:
+                    rows[item] = [_parse_cell(cell.group(0)) for cell in cells]
+
+            if rows:
+                yield page_num, periods, rows
+
+
+class FinancialMetrics:
+    """Columnar line item x period table parsed from the document"""
+
+    def __init__(self, periods, values, page_numbers):
+        """
+        Args:
+        periods (list): `(label, year, quarter, group)` per column, group is the column's header group (e.g. three vs nine months)
+        values (dict): line item -> one float per period (NaN when missing)
+        page_numbers (list): Pages the values were parsed from
+        """
+        self.periods = periods
+        self.items = list(values)
+        # items x periods, every line item is a row view into this matrix
+        self.matrix = np.asarray([values[item] for item in self.items], dtype=np.float64).reshape(len(self.items), len(periods))
+        self.page_numbers = page_numbers
+
+    @property
+    def values(self):
+        """line item -> NumPy array with one value per period"""
+        return dict(zip(self.items, self.matrix))
+
+    @property
+    def period_labels(self):
+        return [label for label, _, _, _ in self.periods]
+
+    def _prior_year_columns(self) -> np.ndarray:
+        """Index of the same period one year earlier in the same header group for every column,
+        -1 when the group doesn't have it or has it more than once (no YoY rather than a guessed one)"""
+        prior = np.full(len(self.periods), -1)
+        for column, (_, year, quarter, group) in enumerate(self.periods):
+            candidates = [
+                other for other, (_, other_year, other_quarter, other_group) in enumerate(self.periods)
+                if other_group == group and other_year == year - 1 and other_quarter == quarter
+            ]
+            if len(candidates) == 1:
+                prior[column] = candidates[0]
+        return prior
+
+    def yoy_growth(self):
+        """line item -> YoY growth per period as a fraction (NaN when there's no prior year column)"""
+        prior = self._prior_year_columns()
+        previous = np.where(prior >= 0, self.matrix[:, np.maximum(prior, 0)], np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth = np.where(previous != 0, (self.matrix - previous) / np.abs(previous), np.nan)
+        return dict(zip(self.items, growth))
+
+    def margins(self):
+        """line item -> item / revenue per period, for the items in MARGIN_ITEMS"""
+        if "Revenue" not in self.items:
+            return {}
+        revenue = self.matrix[self.items.index("Revenue")]
+        rows = [self.items.index(item) for item in MARGIN_ITEMS if item in self.items]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            margins = np.where(revenue != 0, self.matrix[rows] / revenue, np.nan)
+        return {f"{self.items[row]} Margin": margin for row, margin in zip(rows, margins)}
+
+    def to_table(self) -> str:
+        """Compact pipe separated table with values as reported, YoY growth and margins"""
+
+        def row(label, cells):
+            return " | ".join([label, *cells])
+
+        def amount(value):
+            if np.isnan(value):
+                return "n/a"
+            return f"{value:,.2f}" if abs(value) < 100 and value != int(value) else f"{value:,.0f}"
+
+        def percent(value):
+            return "n/a" if np.isnan(value) else f"{value * 100:+.1f}%"
+
+        lines = [
+            f"Source pages: {', '.join(str(page) for page in self.page_numbers)} (values as reported in the document's units)",
+            row("Line item", self.period_labels),
+        ]
+        lines += [row(item, [amount(value) for value in values]) for item, values in self.values.items()]
+        lines += [
+            row(f"{item} YoY", [percent(value) for value in growth])
+            for item, growth in self.yoy_growth().items() if not np.all(np.isnan(growth))
+        ]
+        lines += [
+            row(item, [percent(value).lstrip("+") for value in margin])
+            for item, margin in self.margins().items()
+        ]
+        return "\n".join(lines)
+
+
+def extract_financial_metrics(pages):
+    """Parse the main financial table of a document
+
+    The table with the most recognised line items wins, items missing from it are filled in from
+    other tables with the same period columns.
+
+    Args:
+        pages (list): `[(page_number, cleaned_text), ...]` as returned by `load_clean_pages`
+
+    Returns:
+        FinancialMetrics | None: None when no financial table was detected
+    """
+    tables = list(_parse_tables(pages))
+    if not tables:
+        return None
+
+    page_num, periods, rows = max(tables, key=lambda table: len(table[2]))
+    page_numbers = [page_num]
+    rows = dict(rows)
+    for other_page, other_periods, other_rows in tables:
+        if other_periods != periods:
+            continue
+        for item, values in other_rows.items():
+            if item not in rows:
+                rows[item] = values
+                if other_page not in page_numbers:
+                    page_numbers.append(other_page)
+
+    values = {item: rows[item] for item in DISPLAY_ORDER if item in rows}
+    return FinancialMetrics(periods, values, sorted(page_numbers))
+
+
+def build_metrics_table(pages) -> str:
+    """Metrics table handed to the crew as the `metrics` input"""
+    metrics = extract_financial_metrics(pages)
+    if metrics is None:
+        return "No structured financial table could be extracted; rely on the document pages."
+    return metrics.to_table()
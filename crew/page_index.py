@@ -0,0 +1,104 @@
+# This file has a small BM25 index over the cleaned pages of a document, so agents can pull only the pages relevant to them
+# instead of the entire document. Indexes are built once per document content and kept in a per-process LRU.
+
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from dotenv import load_dotenv
+load_dotenv()
+
+from crew.pdf_cache import pdf_extraction_cache, cached_file_sha256
+from crew.pdf_extraction import PDF_CLEANING_SETTINGS, load_clean_pages
+
+# How many document indexes a process keeps around
+PAGE_INDEX_CACHE_SIZE = int(os.getenv("PAGE_INDEX_CACHE_SIZE", "32"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str):
+    """Lowercase word/number tokens of a text, without stopwords"""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class BM25PageIndex:
+    """Okapi BM25 index where every cleaned page is one document"""
+
+    def __init__(self, pages, k1: float = 1.5, b: float = 0.75):
+        """
+        Build the index.
+
+        Args:
+        pages (list): `[(page_number, cleaned_text), ...]` as returned by `load_clean_pages`
+        k1 (float, optional): Term frequency saturation
+        b (float, optional): Page length normalization
+        """
+        self.pages = list(pages)
+        self.k1 = k1
+        self.b = b
+
+        # postings: term -> [(page index, term frequency), ...]
+        self.postings = {}
+        self.page_lengths = []
+        for index, (_, text) in enumerate(self.pages):
+            term_counts = Counter(tokenize(text))
+            self.page_lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((index, count))
+
+        page_count = len(self.pages)
+        self.avg_page_length = (sum(self.page_lengths) / page_count) if page_count else 0.0
+        self.idf = {
+            term: math.log(1 + (page_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 5):
+        """Rank pages against a query
+
+        Args:
+            query (str): Free text query
+            top_k (int, optional): Max number of pages returned. Defaults to 5.
+
+        Returns:
+            list: `[(page_number, score, text), ...]` best first, pages without any query term are left out
+        """
+        scores = {}
+        avg_length = self.avg_page_length or 1.0
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.page_lengths[index] / avg_length)
+                scores[index] = scores.get(index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.pages[index][0], score, self.pages[index][1]) for index, score in ranked]
+
+
+_index_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_page_index(file_path: str) -> BM25PageIndex:
+    """Return the BM25 index of a PDF, building it from the (cached) cleaned pages on first use"""
+    key = pdf_extraction_cache.make_key(cached_file_sha256(file_path), PDF_CLEANING_SETTINGS)
+    with _lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = BM25PageIndex(load_clean_pages(file_path))
+    with _lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > PAGE_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
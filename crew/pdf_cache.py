@@ -0,0 +1,135 @@
+# This file has a content-addressed disk cache for cleaned PDF pages, so the same document uploaded again skips parsing entirely
+
+import hashlib
+import json
+import os
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+# Cache location and size bound, configurable via env vars
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "cache/pdf_pages")
+PDF_CACHE_MAX_MB = int(os.getenv("PDF_CACHE_MAX_MB", "512"))
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file's bytes without loading it fully into memory
+
+    Args:
+        file_path (str): Path of the file to hash
+        chunk_size (int, optional): Bytes read per iteration. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex SHA-256 digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+
+def cached_file_sha256(file_path: str) -> str:
+    """Same as `file_sha256`, but the file is only re-hashed when it changes on disk"""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+    if digest is None:
+        digest = file_sha256(file_path)
+        with _digest_lock:
+            # upload paths are unique per job, so keep this memo from growing forever
+            if len(_digest_memo) >= 1024:
+                _digest_memo.clear()
+            _digest_memo[memo_key] = digest
+    return digest
+
+
+def remember_file_sha256(file_path: str, digest: str) -> None:
+    """Seed the `cached_file_sha256` memo with a digest computed elsewhere (e.g. while the upload was streamed to disk)"""
+    stat = os.stat(file_path)
+    with _digest_lock:
+        if len(_digest_memo) >= 1024:
+            _digest_memo.clear()
+        _digest_memo[(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)] = digest
+
+
+class PDFExtractionCache:
+    """Disk backed LRU cache of cleaned per-page PDF text"""
+
+    def __init__(self, cache_dir: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_MB * 1024 * 1024):
+        """
+        Initialize the cache, the directory is only created on first write.
+
+        Args:
+        cache_dir (str, optional): Directory holding one JSON file per cached document
+        max_bytes (int, optional): Total size the cache may grow to before least recently used entries are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(content_hash: str, settings: dict) -> str:
+        """Build the cache key from the document content hash and the cleaning settings used on it"""
+        settings_blob = json.dumps(settings, sort_keys=True)
+        return hashlib.sha256(f"{content_hash}:{settings_blob}".encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        """Return cached `[(page_number, text), ...]` for the key, or None on a miss"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                pages = [(page_num, text) for page_num, text in json.load(f)]
+            # bump the mtime so eviction treats this entry as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return pages
+
+    def put(self, key: str, pages) -> None:
+        """Store the cleaned pages for a key and evict old entries if the cache is over its size bound"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key)
+        # write to a temp file first so concurrent readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(pages), f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_bytes`"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue  # removed by another worker meanwhile
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        for _, size, name in sorted(entries):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+# shared instance used by the PDF tools
+pdf_extraction_cache = PDFExtractionCache()
@@ -0,0 +1,201 @@
+# This file has the page level PDF extraction pipeline used by the PDF tools:
+# pages are extracted (in parallel for large documents), cleaned in a single regex pass and cached by content hash
+
+import atexit
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+load_dotenv()
+
+import pypdfium2
+
+from crew.pdf_cache import pdf_extraction_cache, cached_file_sha256
+
+# Documents with at least this many pages are fanned out to the process pool, below it shipping the pages back costs more
+# than extracting them in process (benchmarks/pdf_extraction.py measures both)
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "200"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+# Settings that change the cleaned output, part of the extraction cache key so a change invalidates old entries
+PDF_CLEANING_SETTINGS = {
+    "min_words": 5,
+    "version": 2,
+}
+
+# One alternation covering every whitespace/spacing fix, so each page is normalized in a single linear pass
+_NORMALIZE_RE = re.compile(r"(?:\r\n?|\n){2,}|\r\n?|\$ | %| ,| {2,}")
+_SPACING_FIXES = {"$ ": "$", " %": "%", " ,": ","}
+
+
+def _normalize_match(match: re.Match) -> str:
+    token = match.group(0)
+    if token[0] in "\r\n":
+        return "\n"
+    return _SPACING_FIXES.get(token, " ")
+
+
+def clean_page_text(content: str, min_words: int = PDF_CLEANING_SETTINGS["min_words"]):
+    """Clean and format the text of a single page
+
+    Args:
+        content (str): Raw page text
+        min_words (int, optional): Pages with fewer words are dropped to manage input size
+
+    Returns:
+        str | None: Cleaned text, or None if the page should be skipped
+    """
+    # skip pages with no content or less than `min_words` words
+    if len(content.split(None, min_words)) < min_words:
+        return None
+
+    # normalize line endings, collapse blank lines and fix common spacing issues like "$ 5" or "10 %"
+    return _NORMALIZE_RE.sub(_normalize_match, content).strip()
+
+
+def _extract_page_range(file_path: str, start: int, stop: int, min_words: int):
+    """Extract and clean pages `[start, stop)`, runs inside pool workers so it opens its own document handle"""
+    pdf = pypdfium2.PdfDocument(file_path)
+    pages = []
+    try:
+        for index in range(start, stop):
+            page = pdf[index]
+            text_page = page.get_textpage()
+            content = text_page.get_text_bounded()
+            text_page.close()
+            page.close()
+
+            cleaned = clean_page_text(content, min_words)
+            if cleaned is not None:
+                pages.append((index + 1, cleaned))
+    finally:
+        pdf.close()
+    return pages
+
+
+# One extraction pool per worker process, started on the first large document and kept, spawning fresh interpreters per
+# document would cost more than the extraction itself
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawned, not forked: the caller is a threaded Celery worker (crew threads, PDF cache locks), a fork would copy
+            # whatever locks other threads hold at that moment into the children
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool, the next large document starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _shutdown_pool() -> None:
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_clean_pages(file_path: str, min_words: int = PDF_CLEANING_SETTINGS["min_words"], workers: int = PDF_EXTRACT_WORKERS):
+    """Yield `(page_number, cleaned_text)` in page order as pages become available
+
+    Args:
+        file_path (str): Path of the pdf file
+        min_words (int, optional): Pages with fewer words are skipped
+        workers (int, optional): Max worker processes for large documents
+
+    Yields:
+        tuple: `(page_number, cleaned_text)`
+    """
+    try:
+        pdf = pypdfium2.PdfDocument(file_path)
+        page_count = len(pdf)
+        pdf.close()
+    except Exception as e:
+        raise Exception(f"Error loading the PDF: {str(e)}")
+
+    workers = max(1, min(workers, page_count))
+    if page_count < PDF_PARALLEL_PAGE_THRESHOLD or workers == 1:
+        yield from _extract_page_range(file_path, 0, page_count, min_words)
+        return
+
+    # a couple of chunks per worker keeps the pool busy when some pages are much denser than others
+    chunk_size = -(-page_count // (workers * 2))
+    bounds = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+    # pages up to here were yielded, a failing pool only costs the rest
+    next_page = 0
+    pool = None
+    try:
+        pool = _get_pool(workers)
+        # map submits every chunk up front and keeps their order, so pages stream out in order as each chunk is done
+        chunks = pool.map(
+            _extract_page_range,
+            [file_path] * len(bounds),
+            [start for start, _ in bounds],
+            [stop for _, stop in bounds],
+            [min_words] * len(bounds),
+        )
+        for (_, stop), chunk in zip(bounds, chunks):
+            yield from chunk
+            next_page = stop
+        return
+    except BrokenProcessPool as e:
+        # a child died (e.g. killed for memory), the pool can't be used anymore
+        print(f"PDF extraction pool broke on {file_path}, extracting the remaining pages in process: {e}")
+        _discard_pool(pool)
+    except Exception as e:
+        # e.g. daemonic pool children can't start processes of their own, or the page range failed inside a child
+        print(f"PDF extraction pool failed on {file_path}, extracting the remaining pages in process: {e}")
+
+    try:
+        pages = _extract_page_range(file_path, next_page, page_count, min_words)
+    except Exception as e:
+        raise Exception(f"Error loading the PDF: {str(e)}")
+    yield from pages
+
+
+def load_clean_pages(file_path: str, usage: dict = None):
+    """Return the cleaned pages of a PDF, parsing it only if the same bytes weren't seen before
+
+    Args:
+        file_path (str): Path of the pdf file
+        usage (dict, optional): Gets the lookup added to its `pdf_cache_hits` / `pdf_cache_misses`, for the job's metrics
+
+    Returns:
+        list: `[(page_number, cleaned_text), ...]`
+    """
+    cache_key = pdf_extraction_cache.make_key(cached_file_sha256(file_path), PDF_CLEANING_SETTINGS)
+    pages = pdf_extraction_cache.get(cache_key)
+    if usage is not None:
+        field = "pdf_cache_misses" if pages is None else "pdf_cache_hits"
+        usage[field] = usage.get(field, 0) + 1
+    if pages is not None:
+        return pages
+
+    pages = list(iter_clean_pages(file_path, PDF_CLEANING_SETTINGS["min_words"]))
+    pdf_extraction_cache.put(cache_key, pages)
+    return pages
+
+
+def format_pages(pages) -> str:
+    """Join cleaned pages into the report text handed to the agents, with page number separators"""
+    return "\n\n".join(
+        f"----------- Page Number {page_num} ---------------\n{content}"
+        for page_num, content in pages
+    )
@@ -0,0 +1,186 @@
+# This file has a cached, rate-aware wrapper around the web search tool: results are kept for a freshness window,
+# duplicate in-flight searches are coalesced (across threads and worker processes) and outbound calls are spaced out
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any
+from dotenv import load_dotenv
+load_dotenv()
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field, PrivateAttr
+
+from crew.cache_store import SQLiteTTLStore
+
+# Cache location and behaviour, configurable via env vars
+SEARCH_CACHE_DB_PATH = os.getenv("SEARCH_CACHE_DB_PATH", "cache/responses.db")
+SEARCH_CACHE_FRESHNESS_SECONDS = int(os.getenv("SEARCH_CACHE_FRESHNESS_SECONDS", str(6 * 3600)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+SEARCH_MAX_CALLS_PER_MINUTE = int(os.getenv("SEARCH_MAX_CALLS_PER_MINUTE", "60"))
+# How long a worker may hold the lease on a query before others stop waiting for it
+SEARCH_LEASE_SECONDS = float(os.getenv("SEARCH_LEASE_SECONDS", "30"))
+
+
+def normalize_search_args(kwargs: dict) -> dict:
+    """Arguments with the query lowercased and whitespace collapsed, so near-duplicate queries share an entry"""
+    normalized = dict(kwargs)
+    query = normalized.pop("search_query", None) or normalized.pop("query", None) or ""
+    normalized["search_query"] = " ".join(str(query).lower().split()).strip(" ?.!")
+    return normalized
+
+
+class _InFlight:
+    """A search this process is currently running, followers wait on it instead of searching again"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CachedSearchTool(BaseTool):
+    """Wraps a search tool (SerperDevTool by default) with a shared result cache and request coalescing"""
+
+    name: str = "Search the internet with Serper"
+    description: str = "A tool that can be used to search the internet with a search_query."
+    search: Any = None
+    freshness_seconds: float = SEARCH_CACHE_FRESHNESS_SECONDS
+    max_calls_per_minute: int = SEARCH_MAX_CALLS_PER_MINUTE
+    lease_seconds: float = SEARCH_LEASE_SECONDS
+    cache_store: Any = None
+
+    _inflight: dict = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _rate_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _next_call_at: float = PrivateAttr(default=0.0)
+    _stats: dict = PrivateAttr(default_factory=lambda: {"hits": 0, "misses": 0, "coalesced": 0, "outbound": 0})
+
+    def __init__(self, search: BaseTool, **kwargs):
+        """
+        Args:
+        search (BaseTool): Tool doing the actual search, its name and argument schema are reused so agents see no difference
+        """
+        kwargs.setdefault("name", search.name)
+        # the inner description already has the generated "Tool Name/Arguments" block, use the raw one
+        kwargs.setdefault("description", type(search).model_fields["description"].default)
+        kwargs.setdefault("args_schema", search.args_schema)
+        super().__init__(search=search, **kwargs)
+        if self.cache_store is None:
+            self.cache_store = SQLiteTTLStore(
+                SEARCH_CACHE_DB_PATH, "search_results", self.freshness_seconds, SEARCH_CACHE_MAX_ENTRIES
+            )
+
+    @staticmethod
+    def cache_key(kwargs: dict) -> str:
+        blob = json.dumps(normalize_search_args(kwargs), sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def stats(self) -> dict:
+        """Counters of this process: cache hits/misses, searches that joined an in-flight one and outbound calls"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _call_search(self, kwargs: dict):
+        """Run the wrapped search, keeping outbound calls under `max_calls_per_minute` for this process"""
+        if self.max_calls_per_minute > 0:
+            with self._rate_lock:
+                wait = self._next_call_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self._next_call_at = max(time.monotonic(), self._next_call_at) + 60 / self.max_calls_per_minute
+        self._count("outbound")
+        return self.search.run(**kwargs)
+
+    def _search_once_across_workers(self, key: str, kwargs: dict):
+        """Search unless another worker process is already doing it, in which case wait for its result"""
+        while True:
+            if self.cache_store.try_claim(key, self.lease_seconds):
+                try:
+                    # another worker may have stored it between our cache lookup and the claim
+                    cached = self.cache_store.get(key)
+                    if cached is not None:
+                        return json.loads(cached)
+                    result = self._call_search(kwargs)
+                    self.cache_store.set(key, json.dumps(result, default=str), ttl_seconds=self.freshness_seconds)
+                    return result
+                finally:
+                    self.cache_store.release_claim(key)
+
+            # the lease holder stores the result when done; if it dies the lease expires and we claim it
+            time.sleep(0.2)
+            cached = self.cache_store.get(key)
+            if cached is not None:
+                self._count("coalesced")
+                return json.loads(cached)
+
+    def _run(self, **kwargs: Any) -> Any:
+        key = self.cache_key(kwargs)
+        cached = self.cache_store.get(key)
+        if cached is not None:
+            self._count("hits")
+            return json.loads(cached)
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+
+        if not leader:
+            # same query already running in this process
+            self._count("coalesced")
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        self._count("misses")
+        try:
+            flight.result = self._search_once_across_workers(key, kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+class StubSearchSchema(BaseModel):
+    search_query: str = Field(..., description="Mandatory search query you want to use to search the internet")
+
+
+class StubSearchTool(BaseTool):
+    """Offline stand-in for SerperDevTool with canned results, for local runs and benchmarks"""
+
+    name: str = "Search the internet with Serper"
+    description: str = "A tool that can be used to search the internet with a search_query."
+    args_schema: type = StubSearchSchema
+    latency_seconds: float = float(os.getenv("STUB_SEARCH_LATENCY_SECONDS", "0"))
+    calls: int = 0
+
+    def _run(self, **kwargs: Any) -> Any:
+        query = kwargs.get("search_query") or kwargs.get("query") or ""
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        self.calls += 1
+        return {
+            "searchParameters": {"q": query, "type": "search"},
+            "organic": [
+                {
+                    "title": f"Stub result {position} for {query}",
+                    "link": f"https://example.com/search/{position}",
+                    "snippet": f"Offline placeholder snippet about {query}.",
+                    "position": position,
+                }
+                for position in range(1, 4)
+            ],
+            "credits": 0,
+        }
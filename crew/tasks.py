@@ -3,19 +3,26 @@ from crewai import Task
 from os import makedirs
 from crew.agents import financial_analyst, investment_advisor, risk_assessor, executive_summarizer
 
-# Ensure we create outputs
+# Ensure we create outputs, every job writes into its own outputs/{job_id}/ folder (created by crewai on save)
+# so concurrent workers never overwrite or delete each other's files
 makedirs("outputs", exist_ok=True)
 
 # This task reads the provided PDF at {file_path} to generate a comprehensive financial report
 financial_analysis_task = Task(
+    # task names double as checkpoint stage names in the job database
+    name="financial_analysis",
     description=
     """
-    Use the Read PDF Tool to read the financial document at {file_path} and extract key financial data about the company.
+    Use the Search PDF Tool to pull the relevant pages of the financial document at {file_path} and extract key financial data about the company.
+
+    ### PRE-EXTRACTED METRICS (parsed deterministically from the document's tables, treat these numbers as exact):
+    {metrics}
     
     ### INSTRUCTIONS:
-    1. First, use the Read PDF Tool with the file_path: {file_path}
-    2. Analyze the extracted content for key financial metrics
-    3. Focus on metrics such as revenue, profit margins, net income and earnings per share (EPS)
+    1. First, use the Search PDF Tool with the file_path: {file_path} and focused queries
+       (e.g. "revenue net income earnings per share", "gross operating margin", "cash flow balance sheet", "outlook guidance")
+    2. Analyze the returned pages for key financial metrics, starting from the pre-extracted metrics above
+    3. Focus on metrics such as revenue, profit margins, net income and earnings per share (EPS), only search the document for what the metrics table doesn't cover
     4. Identify any financial trends or patterns
     5. Conduct a comprehensive SWOT (Strengths, Weaknesses, Opportunities and Threats) Analysis
     6. Only provide objective financial analysis - no investment advice or risk assessment
@@ -32,11 +39,12 @@ financial_analysis_task = Task(
 
     agent=financial_analyst,
     # Outputting the task result to see how or what the agent did.
-    output_file="outputs/financial_analysis.txt",
+    output_file="outputs/{job_id}/financial_analysis.txt",
 )
 
 ## Creating an investment analysis task, taking context from the previous task
 investment_analysis_task = Task(
+    name="investment_analysis",
     description=
     """
     Based on the financial analysis report provided, develop or formulate a strategic investment recommendations.
@@ -46,6 +54,8 @@ investment_analysis_task = Task(
     - User's specific query below:
     Query: {query}
 
+    If you need a detail the financial report doesn't cover, use the Search PDF Tool on {file_path} to pull only the relevant pages.
+
     It's important that the recommendation is backed by evidence from the financial report and is clear and easily actionable.
     """,
 
@@ -61,20 +71,22 @@ investment_analysis_task = Task(
     agent=investment_advisor,
     # We provide this agent the result of the previous agent as context to make a flow
     context=[financial_analysis_task],
-    output_file="outputs/investment_advice.txt",
+    output_file="outputs/{job_id}/investment_advice.txt",
 )
 
 ## Creating a risk assessment task
 risk_assessment_task = Task(
+    name="risk_assessment",
     description=
     """
-    Evaluate investment risks based on the financial analysis and investment recommendations provided.
+    Evaluate investment risks based on the {risk_assessment_context} provided.
     ### ASSESS THE FOLLOWING:
     - Financial risks like liquidity of assets, debt, and profitability.
     - Market risks like competition and industry trends.
     - Operational risks like management and regulation.
 
     Use web search tools to find current market conditions of the company or news that may impact it's risk profile.
+    Use the Search PDF Tool on {file_path} for risk disclosures (e.g. "risk factors", "debt maturities liquidity", "litigation regulation") instead of re-reading the document.
 
     Provide balanced and realistic risk assessment that's data driven, objective and avoid sensationalizing the company in any way.
     """,
@@ -90,11 +102,12 @@ risk_assessment_task = Task(
 
     agent=risk_assessor,
     context=[financial_analysis_task, investment_analysis_task],
-    output_file="outputs/risk_assessment.txt"
+    output_file="outputs/{job_id}/risk_assessment.txt"
 )
 
 # Executive Summary Task: Consolidates all analysis into final report
 executive_summary_task = Task(
+    name="executive_summary",
     description=
     """
     Create a comprehensive executive summary that consolidates the financial analysis, investment recommendations, 
@@ -129,7 +142,7 @@ executive_summary_task = Task(
 
     agent=executive_summarizer,
     context=[financial_analysis_task, investment_analysis_task, risk_assessment_task],
-    output_file="outputs/executive_summary.txt"
+    output_file="outputs/{job_id}/executive_summary.txt"
 )
 
 # Extra Notes: We can simply prompt the first agent for verification, making a task for it is redundant.
@@ -0,0 +1,6 @@
+# This file has the dependency free text helpers shared by the crew modules, importing it doesn't build agents or LLMs
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text), good enough for budgeting"""
+    return len(text) // 4 + 1
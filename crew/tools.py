@@ -3,71 +3,68 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 from crewai.tools import BaseTool
+from pydantic import BaseModel, Field
 
 # using the correct Serper import 
 from crewai_tools import SerperDevTool
 
-# using PyPDFium2 Loader from Langchain
-from langchain_community.document_loaders.pdf import PyPDFium2Loader
+# pages are returned separated by their page number
+from crew.pdf_extraction import format_pages
+# lexical page index so agents only read the relevant pages
+from crew.page_index import get_page_index
+# cached, coalescing wrapper around the web search
+from crew.search_cache import CachedSearchTool, StubSearchTool
+
 ## Creating search tool
-search_tool = SerperDevTool()
+# all agents share one cached search, SEARCH_BACKEND=stub swaps Serper for an offline stand-in
+search_tool = CachedSearchTool(
+    search=StubSearchTool() if os.getenv("SEARCH_BACKEND", "serper") == "stub" else SerperDevTool()
+)
+
+# Default number of pages returned by the Search PDF Tool
+PDF_SEARCH_TOP_K = int(os.getenv("PDF_SEARCH_TOP_K", "5"))
 
-## Creating custom pdf reader tool
-class ReadPDFTool(BaseTool):
-    name: str = "Read PDF Tool"
-    description: str = "This tool reads the entire content of a PDF file given its file_path"
-    def _run(self, file_path='data/sample.pdf'):
-        """Tool to read data from a pdf file from a path
+class SearchPDFToolSchema(BaseModel):
+    # explicit, the schema crewai derives from `_run` drops `file_path` and makes `top_k` mandatory
+    file_path: str = Field(..., description="Path of the pdf file to search")
+    query: str = Field(..., description="Keywords describing the information needed")
+    top_k: int = Field(default=PDF_SEARCH_TOP_K, description="Max number of pages returned")
+
+## Creating the page search tool, agents query the document instead of reading it whole
+class SearchPDFTool(BaseTool):
+    name: str = "Search PDF Tool"
+    description: str = (
+        "This tool searches a PDF file given its file_path and a query (e.g. 'revenue net income EPS', 'debt liquidity', 'guidance outlook') "
+        "and returns only the most relevant pages, each with its page number"
+    )
+    args_schema: type = SearchPDFToolSchema
+    def _run(self, file_path='data/sample.pdf', query: str = "", top_k: int = PDF_SEARCH_TOP_K):
+        """Tool to fetch the pages of a pdf file that are most relevant to a query
 
         Args:
-            path (str, optional): Path of the pdf file. Defaults to 'data/sample.pdf'.
+            file_path (str, optional): Path of the pdf file. Defaults to 'data/sample.pdf'.
+            query (str): Keywords describing the information needed.
+            top_k (int, optional): Max number of pages returned. Defaults to PDF_SEARCH_TOP_K.
 
         Returns:
-            str: Full Financial Document file
+            str: Matching pages in page order, separated by their page number
         """
 
         if not file_path or not os.path.exists(file_path):
             return f"Error: File not found at {file_path}"
-        
+
         if not file_path.lower().endswith(".pdf"):
             return "Error: This tool only works with PDF (.pdf) files"
-        
-        try:
-            # we'll load it page wise asynchronously
-            docs = PyPDFium2Loader(file_path=file_path, mode="page").load()
-        except Exception as e:
-            raise Exception(f"Error loading the PDF: {str(e)}")
-
-        full_report = ""
-        for page_num, data in enumerate(docs, 1):
-            # Clean and format the financial document data
-            content = data.page_content
-
-            # skip pages with no content
-            if not content.strip(): 
-                continue
-            
-            # Skip pages with less than 5 words to manage input size.
-            word_count = len(content.strip().split())
-            if word_count < 5:
-                continue
-
-            # Remove extra whitespaces and format properly
-            while "\n\n\n" in content:
-                content = content.replace("\n\n\n", "\n\n")
-            while "\n\n" in content:
-                content = content.replace("\n\n", "\n")
-
-            # fix any common spacing issues
-            content = content.replace("$ ", "$") 
-            content = content.replace(" %", "%") 
-            content = content.replace(" ,", ",") 
-            content = content.replace("  ", " ") 
-                
-            # add page number as a separator
-            full_report += f"----------- Page Number {page_num} ---------------\n{content.strip()}\n\n"
-            
-        return full_report.strip()
+
+        if not query or not query.strip():
+            return "Error: Provide a query describing the information you need"
+
+        matches = get_page_index(file_path).search(query, top_k=max(1, int(top_k)))
+        if not matches:
+            return f"No pages matched the query: {query}"
+
+        # keep document order so tables split across pages read naturally
+        return format_pages(sorted((page_num, text) for page_num, _, text in matches))
 
 # Creating Investment Analysis Tool: REMOVED
 
@@ -1,14 +1,58 @@
 # This file has an sqlite database to store concurrent analysis requests with their result, a tracker for the job queue system
 
-from sqlalchemy import create_engine, Text, Column, String, DateTime
+from sqlalchemy import create_engine, event, func, inspect, text, Text, Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import gzip
+import hashlib
 import os
+import re
+import threading
 from uuid import uuid4
+from dotenv import load_dotenv
+load_dotenv()
 
 Base = declarative_base()
 
+# Database location and connection settings, configurable via env vars
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "job_database/analysis_jobs.db")
+JOB_DB_POOL_SIZE = int(os.getenv("JOB_DB_POOL_SIZE", "10"))
+JOB_DB_MAX_OVERFLOW = int(os.getenv("JOB_DB_MAX_OVERFLOW", "20"))
+# How long a connection waits for another one's write lock before failing with "database is locked"
+JOB_DB_BUSY_TIMEOUT_MS = int(os.getenv("JOB_DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Large results are moved out of the table into gzip files here by the retention job (job_database/retention.py)
+RESULT_ARCHIVE_DIR = os.getenv("RESULT_ARCHIVE_DIR", "job_database/results")
+
+# One engine (and its connection pool) per database and process, see `DocumentAnalysisJobDB`
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Statuses of a job that hasn't finished yet, an identical submission attaches to such a job instead of starting another
+ACTIVE_JOB_STATUSES = ("In Queue", "Processing", "Retrying")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+
+def make_dedup_key(content_hash: str, query: str, model: str) -> str:
+    """
+    Key of a submission for request coalescing, identical documents with the same (normalized) query on the same model share it.
+
+    Args:
+    content_hash (str): SHA-256 of the uploaded file
+    query (str): User's analysis query, compared case and whitespace insensitively
+    model (str): LLM the crew runs on
+
+    Returns:
+    str: Hex SHA-256 of the three parts
+    """
+    normalized_query = _WHITESPACE_RE.sub(" ", query).strip().lower()
+    return hashlib.sha256(f"{content_hash}\n{normalized_query}\n{model}".encode()).hexdigest()
+
 class DocumentAnalysisJobs(Base):
     """Table schema definition"""
     __tablename__ = "document_analysis_jobs"
@@ -18,30 +62,311 @@ class DocumentAnalysisJobs(Base):
     analysis_query = Column(String, nullable=False)
     job_status = Column(String, default="In Queue")
     job_result = Column(Text)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    # stage the worker is on (parsing or a crew task), published as progress events too
+    job_stage = Column(String)
+    # set once the retention job moved a large `job_result` to a compressed file, read it with `read_job_result`
+    result_path = Column(String)
+    created_at = Column(DateTime, default=_utc_now)
+    updated_at = Column(DateTime, default=_utc_now, onupdate=_utc_now)
+    # request coalescing, see `make_dedup_key`
+    content_hash = Column(String)
+    dedup_key = Column(String)
+    # JSON timings, token counts, cache hits and retries of the job's attempts, written by the worker (celery_jobs/job_metrics.py)
+    job_metrics = Column(Text)
+    # pages estimated by the API at upload time and the size class (queue) the job was routed to, see celery_jobs/celery_app.py
+    page_estimate = Column(Integer)
+    queue_class = Column(String)
+
+    __table_args__ = (
+        # status filters ordered by age (queue views, listings) and time range scans
+        Index("ix_document_analysis_jobs_status_created_at", "job_status", "created_at"),
+        Index("ix_document_analysis_jobs_created_at", "created_at"),
+        # at most one unfinished job per key, so racing duplicate submissions can't both start a job
+        Index(
+            "ix_document_analysis_jobs_active_dedup_key", "dedup_key", unique=True,
+            sqlite_where=text("job_status IN ('In Queue', 'Processing', 'Retrying')"),
+        ),
+        Index("ix_document_analysis_jobs_dedup_key", "dedup_key"),
+        # queued jobs per size class and its recently completed ones, for admission control
+        Index("ix_document_analysis_jobs_queue_class_status_updated_at", "queue_class", "job_status", "updated_at"),
+    )
+
+class DocumentAnalysisStages(Base):
+    """Checkpoint of a finished pipeline stage (metrics or one of the crew tasks), a resumed job skips these"""
+    __tablename__ = "document_analysis_stages"
+
+    job_id = Column(String, ForeignKey("document_analysis_jobs.job_id"), primary_key=True)
+    stage = Column(String, primary_key=True)
+    stage_output = Column(Text, nullable=False)
+    completed_at = Column(DateTime, default=_utc_now)
+
+class DocumentAnalysisBatches(Base):
+    """A batch submission, progress is aggregated over its jobs"""
+    __tablename__ = "document_analysis_batches"
+
+    batch_id = Column(String, primary_key=True, default=lambda: f"Batch_{str(uuid4())}")
+    created_at = Column(DateTime, default=_utc_now)
+
+class DocumentAnalysisBatchJobs(Base):
+    """Jobs of a batch, a job coalesced with an earlier submission can belong to several batches"""
+    __tablename__ = "document_analysis_batch_jobs"
+
+    batch_id = Column(String, ForeignKey("document_analysis_batches.batch_id"), primary_key=True)
+    job_id = Column(String, ForeignKey("document_analysis_jobs.job_id"), primary_key=True)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets API reads run while a worker writes, the rest trades a little durability on power loss for fewer fsyncs"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={JOB_DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")  # 16 MB page cache per connection
+    cursor.close()
+
+
+def _ensure_schema(engine):
+    """Create missing tables, then add columns and indexes introduced after a database was created (`create_all` leaves existing tables alone)"""
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if missing:
+            with engine.begin() as connection:
+                for column in missing:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def get_engine(db_path: str = JOB_DB_PATH):
+    """
+    Process wide engine of a job database, created (with the schema checked) on first use only.
+
+    Args:
+    db_path (str, optional): Path to the SQLite Database File
+
+    Returns:
+    tuple: `(engine, sessionmaker)` shared by every `DocumentAnalysisJobDB` of this process
+    """
+    # keyed by pid too: pooled connections must not be shared with a forked child (e.g. Celery prefork workers)
+    key = (os.path.abspath(db_path), os.getpid())
+    with _engines_lock:
+        if key not in _engines:
+            os.makedirs(os.path.dirname(key[0]), exist_ok=True)
+            engine = create_engine(
+                f"sqlite:///{db_path}",
+                connect_args={"check_same_thread" : False},
+                pool_size=JOB_DB_POOL_SIZE,
+                max_overflow=JOB_DB_MAX_OVERFLOW,
+            )
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+            _ensure_schema(engine)
+            # autocommit=False: Manual transaction control for better consistency - helps in batching db commits, can rollback transaction in case of issues
+            # autoflush=True: Automatic flushing ensures queries see latest changes
+            _engines[key] = (engine, sessionmaker(autocommit=False, autoflush=True, bind=engine))
+        return _engines[key]
+
 
 class DocumentAnalysisJobDB:
     """Manager class for the Job database"""
 
     def __init__(self, db_path:str=None):
         """
-        Initialize the DB connection via SQLite.
+        Initialize the DB connection via SQLite. Cheap to call per request or task: the engine, its connection pool
+        and the schema check are shared process wide (see `get_engine`).
 
         Args:
-        db_path (str, optional): Path to the SQLite Database File, if None, will use the `job_database` folder
+        db_path (str, optional): Path to the SQLite Database File, if None, will use JOB_DB_PATH (the `job_database` folder by default)
         """
 
         if db_path is None:
-            db_dir = "job_database"
-            db_path = f"{db_dir}/analysis_jobs.db"
+            db_path = JOB_DB_PATH
 
         self.db_url = f'sqlite:///{db_path}'
-        self.engine = create_engine(self.db_url, connect_args={"check_same_thread" : False})
-
-        Base.metadata.create_all(bind=self.engine)
+        self.engine, self._session_factory = get_engine(db_path)
 
     def get_local_session(self):
-        # autocommit=False: Manual transaction control for better consistency - helps in batching db commits, can rollback transaction in case of issues
-        # autoflush=True: Automatic flushing ensures queries see latest changes
-        return sessionmaker(autocommit=False, autoflush=True, bind=self.engine)
\ No newline at end of file
+        return self._session_factory
+
+    def save_stage_output(self, job_id: str, stage: str, stage_output: str) -> None:
+        """
+        Checkpoint a finished stage in its own short transaction, so it survives a later failure of the job.
+
+        Args:
+        job_id (str): Job the stage belongs to
+        stage (str): Stage name, e.g. `metrics` or a crew task name
+        stage_output (str): Output to hand to later stages when the job is resumed
+        """
+        session = self.get_local_session()()
+        try:
+            session.merge(DocumentAnalysisStages(job_id=job_id, stage=stage, stage_output=stage_output))
+            session.commit()
+        finally:
+            session.close()
+
+    def set_job_stage(self, job_id: str, stage: str) -> None:
+        """Record the stage a job is on, in its own short transaction (crew tasks report from their own threads)"""
+        session = self.get_local_session()()
+        try:
+            session.query(DocumentAnalysisJobs).filter_by(job_id=job_id).update({"job_stage": stage, "updated_at": _utc_now()})
+            session.commit()
+        finally:
+            session.close()
+
+    def save_job_metrics(self, job_id: str, job_metrics: str) -> None:
+        """Store a job's metrics JSON in its own short transaction, so a worker crash keeps what was measured so far"""
+        session = self.get_local_session()()
+        try:
+            session.query(DocumentAnalysisJobs).filter_by(job_id=job_id).update({"job_metrics": job_metrics})
+            session.commit()
+        finally:
+            session.close()
+
+    def get_stage_outputs(self, job_id: str) -> dict:
+        """Return `{stage: output}` of every checkpointed stage of a job"""
+        session = self.get_local_session()()
+        try:
+            rows = session.query(DocumentAnalysisStages).filter_by(job_id=job_id).all()
+            return {row.stage: row.stage_output for row in rows}
+        finally:
+            session.close()
+
+
+def find_reusable_job(session, dedup_key: str, freshness_seconds: int):
+    """
+    Look up a job an identical submission can share: an unfinished one, or one completed within the freshness window.
+
+    Args:
+    session (Session): Session to query with
+    dedup_key (str): Key from `make_dedup_key`
+    freshness_seconds (int): How long a completed result may be served to new submissions, 0 disables reuse of results
+
+    Returns:
+    DocumentAnalysisJobs | None: The job to attach to, if any
+    """
+    jobs = session.query(DocumentAnalysisJobs).filter(DocumentAnalysisJobs.dedup_key == dedup_key)
+    in_flight = jobs.filter(DocumentAnalysisJobs.job_status.in_(ACTIVE_JOB_STATUSES)).first()
+    if in_flight is not None or freshness_seconds <= 0:
+        return in_flight
+
+    # SQLite hands back naive datetimes, they're stored in UTC
+    fresh_after = (datetime.now(timezone.utc) - timedelta(seconds=freshness_seconds)).replace(tzinfo=None)
+    return (
+        jobs.filter(DocumentAnalysisJobs.job_status == "Completed", DocumentAnalysisJobs.updated_at >= fresh_after)
+        .order_by(DocumentAnalysisJobs.updated_at.desc())
+        .first()
+    )
+
+
+def upload_still_needed(session, file_path: str, job_id: str) -> bool:
+    """Whether another unfinished job (e.g. another query of the same batch document) still reads this upload"""
+    return session.query(DocumentAnalysisJobs).filter(
+        DocumentAnalysisJobs.file_path == file_path,
+        DocumentAnalysisJobs.job_id != job_id,
+        DocumentAnalysisJobs.job_status != "Completed",
+    ).first() is not None
+
+
+def estimate_queue_backlog(session, queue_class: str, default_job_seconds: float, stage_count: int, sample_size: int = 50) -> tuple:
+    """
+    Work left in a size class's queue, in jobs, and the average time a job of that class takes.
+    Queued, retrying and processing jobs count with the share of their stages that isn't checkpointed yet,
+    so a job about to finish barely adds to the backlog while a fresh one counts in full.
+
+    Args:
+    session (Session): Session to query with
+    queue_class (str): Size class, see `celery_jobs.celery_app.QUEUE_CLASSES`
+    default_job_seconds (float): Time per job assumed while no completed job of the class has metrics
+    stage_count (int): Checkpointed stages of a whole job, see `celery_jobs.celery_app.JOB_STAGE_COUNT`
+    sample_size (int, optional): How many of the most recently completed jobs to average over
+
+    Returns:
+    tuple: `(backlog_jobs, seconds_per_job)`
+    """
+    completed_stages = (
+        session.query(func.count(DocumentAnalysisStages.stage))
+        .filter(DocumentAnalysisStages.job_id == DocumentAnalysisJobs.job_id)
+        .correlate(DocumentAnalysisJobs)
+        .scalar_subquery()
+    )
+    # SQLite's two argument max() is the scalar one, TOTAL() is 0.0 rather than NULL without rows
+    remaining_stages = session.query(func.total(func.max(0, stage_count - completed_stages))).filter(
+        DocumentAnalysisJobs.queue_class == queue_class,
+        DocumentAnalysisJobs.job_status.in_(ACTIVE_JOB_STATUSES),
+    ).scalar()
+    recent = (
+        session.query(func.json_extract(DocumentAnalysisJobs.job_metrics, "$.processing_seconds").label("seconds"))
+        .filter(
+            DocumentAnalysisJobs.queue_class == queue_class,
+            DocumentAnalysisJobs.job_status == "Completed",
+            DocumentAnalysisJobs.job_metrics.isnot(None),
+        )
+        .order_by(DocumentAnalysisJobs.updated_at.desc())
+        .limit(sample_size)
+        .subquery()
+    )
+    seconds_per_job = session.query(func.avg(recent.c.seconds)).scalar()
+    return remaining_stages / max(1, stage_count), seconds_per_job or default_job_seconds
+
+
+def read_job_result(job) -> str:
+    """A job's result, wherever it's stored: inline in `job_result` or archived to a gzip file by the retention job"""
+    if job.result_path:
+        with gzip.open(job.result_path, "rt", encoding="utf-8") as f:
+            return f.read()
+    return job.job_result
+
+
+# Stage and tool totals are summed inside SQLite (JSON1), the API never loads every job's metrics to aggregate them
+_STAGE_METRICS_SQL = text("""
+    SELECT stage.key AS stage,
+           COUNT(*) AS runs,
+           TOTAL(json_extract(stage.value, '$.seconds')) AS seconds,
+           TOTAL(json_extract(stage.value, '$.llm_requests')) AS llm_requests,
+           TOTAL(json_extract(stage.value, '$.prompt_tokens')) AS prompt_tokens,
+           TOTAL(json_extract(stage.value, '$.completion_tokens')) AS completion_tokens,
+           TOTAL(json_extract(stage.value, '$.llm_cache_hits')) AS llm_cache_hits,
+           TOTAL(json_extract(stage.value, '$.llm_cache_misses')) AS llm_cache_misses,
+           TOTAL(json_extract(stage.value, '$.pdf_cache_hits')) AS pdf_cache_hits,
+           TOTAL(json_extract(stage.value, '$.pdf_cache_misses')) AS pdf_cache_misses
+    FROM document_analysis_jobs AS job, json_each(job.job_metrics, '$.stages') AS stage
+    WHERE job.job_metrics IS NOT NULL
+    GROUP BY stage.key
+""")
+_TOOL_METRICS_SQL = text("""
+    SELECT tool.key AS tool,
+           TOTAL(json_extract(tool.value, '$.calls')) AS calls,
+           TOTAL(json_extract(tool.value, '$.seconds')) AS seconds,
+           TOTAL(json_extract(tool.value, '$.cache_hits')) AS cache_hits
+    FROM document_analysis_jobs AS job, json_each(job.job_metrics, '$.tools') AS tool
+    WHERE job.job_metrics IS NOT NULL
+    GROUP BY tool.key
+""")
+_JOB_METRICS_SQL = text("""
+    SELECT COUNT(*) AS jobs,
+           TOTAL(json_extract(job_metrics, '$.attempts')) AS attempts,
+           TOTAL(json_extract(job_metrics, '$.queue_wait_seconds')) AS queue_wait_seconds,
+           TOTAL(json_extract(job_metrics, '$.processing_seconds')) AS processing_seconds
+    FROM document_analysis_jobs
+    WHERE job_metrics IS NOT NULL
+""")
+
+
+def aggregate_job_metrics(session) -> dict:
+    """
+    Totals of the jobs still in the database (the retention job removes old ones), for the metrics endpoint.
+
+    Args:
+    session (Session): Session to query with
+
+    Returns:
+    dict: `jobs_by_status`, `jobs` (attempts, queue wait and processing totals), `stages` and `tools` (totals per name)
+    """
+    status_rows = session.query(DocumentAnalysisJobs.job_status, func.count()).group_by(DocumentAnalysisJobs.job_status).all()
+    return {
+        "jobs_by_status": {status: count for status, count in status_rows},
+        "jobs": dict(session.execute(_JOB_METRICS_SQL).mappings().one()),
+        "stages": {row["stage"]: dict(row) for row in session.execute(_STAGE_METRICS_SQL).mappings()},
+        "tools": {row["tool"]: dict(row) for row in session.execute(_TOOL_METRICS_SQL).mappings()},
+    }
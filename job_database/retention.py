@@ -0,0 +1,181 @@
+# This file has the retention job of the job database: it expires old finished jobs, moves large results out of the table
+# into compressed files and sweeps uploads and output folders left behind by workers that died mid-job.
+# It runs periodically on the Celery beat schedule (celery_jobs/retention_worker.py) or once from the command line:
+#   python -m job_database.retention
+
+import gzip
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+load_dotenv()
+from sqlalchemy import LargeBinary, cast, func
+
+from job_database.job_db import (
+    DocumentAnalysisJobDB, DocumentAnalysisJobs, DocumentAnalysisStages, DocumentAnalysisBatches, DocumentAnalysisBatchJobs,
+    ACTIVE_JOB_STATUSES, RESULT_ARCHIVE_DIR,
+)
+
+# Retention settings, configurable via env vars
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "30"))
+# Completed results larger than this are archived to gzip files
+RESULT_ARCHIVE_MIN_BYTES = int(os.getenv("RESULT_ARCHIVE_MIN_BYTES", str(64 * 1024)))
+# Unreferenced uploads younger than this are left alone, their job row may not be committed yet
+ORPHAN_GRACE_SECONDS = int(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+UPLOAD_DIR = "data"
+OUTPUT_DIR = "outputs"
+# Rows are handled in batches, so the sweep never holds the write lock for long
+RETENTION_BATCH_SIZE = 500
+
+
+def _utc_cutoff(seconds: float) -> datetime:
+    # SQLite hands back naive datetimes, they're stored in UTC
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).replace(tzinfo=None)
+
+
+def expire_old_jobs(job_db: DocumentAnalysisJobDB, retention_days: int = JOB_RETENTION_DAYS) -> int:
+    """
+    Delete finished jobs last updated more than `retention_days` ago, with their checkpoints, batch links and archived result.
+
+    Returns:
+        int: Number of jobs deleted
+    """
+    cutoff = _utc_cutoff(retention_days * 24 * 3600)
+    deleted = 0
+    session = job_db.get_local_session()()
+    try:
+        while True:
+            jobs = (
+                session.query(DocumentAnalysisJobs.job_id, DocumentAnalysisJobs.result_path)
+                .filter(DocumentAnalysisJobs.job_status.notin_(ACTIVE_JOB_STATUSES), DocumentAnalysisJobs.updated_at < cutoff)
+                .limit(RETENTION_BATCH_SIZE)
+                .all()
+            )
+            if not jobs:
+                break
+            job_ids = [job.job_id for job in jobs]
+            session.query(DocumentAnalysisStages).filter(DocumentAnalysisStages.job_id.in_(job_ids)).delete(synchronize_session=False)
+            session.query(DocumentAnalysisBatchJobs).filter(DocumentAnalysisBatchJobs.job_id.in_(job_ids)).delete(synchronize_session=False)
+            session.query(DocumentAnalysisJobs).filter(DocumentAnalysisJobs.job_id.in_(job_ids)).delete(synchronize_session=False)
+            session.commit()
+            for job in jobs:
+                if job.result_path and os.path.exists(job.result_path):
+                    os.remove(job.result_path)
+            deleted += len(jobs)
+
+        # batches whose jobs all expired
+        linked = session.query(DocumentAnalysisBatchJobs.batch_id)
+        session.query(DocumentAnalysisBatches).filter(DocumentAnalysisBatches.batch_id.notin_(linked)).delete(synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    return deleted
+
+
+def archive_large_results(job_db: DocumentAnalysisJobDB, min_bytes: int = RESULT_ARCHIVE_MIN_BYTES,
+                          archive_dir: str = RESULT_ARCHIVE_DIR) -> int:
+    """
+    Move completed results bigger than `min_bytes` into `<archive_dir>/<job_id>.txt.gz`, keeping the table (and its pages) small.
+
+    Returns:
+        int: Number of results archived
+    """
+    archived = 0
+    session = job_db.get_local_session()()
+    try:
+        while True:
+            jobs = (
+                session.query(DocumentAnalysisJobs)
+                .filter(
+                    DocumentAnalysisJobs.job_status == "Completed",
+                    DocumentAnalysisJobs.result_path.is_(None),
+                    # length() of TEXT counts characters, of a BLOB bytes
+                    func.length(cast(DocumentAnalysisJobs.job_result, LargeBinary)) > min_bytes,
+                )
+                .limit(RETENTION_BATCH_SIZE)
+                .all()
+            )
+            if not jobs:
+                break
+            os.makedirs(archive_dir, exist_ok=True)
+            for job in jobs:
+                result_path = os.path.join(archive_dir, f"{job.job_id}.txt.gz")
+                # written to a temp file first, the row only points at complete archives
+                with gzip.open(f"{result_path}.tmp", "wt", encoding="utf-8") as f:
+                    f.write(job.job_result)
+                os.replace(f"{result_path}.tmp", result_path)
+                # updated_at is kept as is, archiving shouldn't restart the job's retention or dedup freshness window
+                session.query(DocumentAnalysisJobs).filter(DocumentAnalysisJobs.job_id == job.job_id).update(
+                    {"result_path": result_path, "job_result": None, "updated_at": DocumentAnalysisJobs.updated_at},
+                    synchronize_session=False,
+                )
+            session.commit()
+            session.expire_all()
+            archived += len(jobs)
+    finally:
+        session.close()
+    return archived
+
+
+def sweep_orphaned_files(job_db: DocumentAnalysisJobDB, grace_seconds: int = ORPHAN_GRACE_SECONDS,
+                         upload_dir: str = UPLOAD_DIR, output_dir: str = OUTPUT_DIR) -> int:
+    """
+    Remove uploads no unfinished or failed job reads anymore, and output folders of jobs that aren't running.
+    Files younger than `grace_seconds` are skipped, an upload is written before its job row is committed.
+
+    Returns:
+        int: Number of files and folders removed
+    """
+    # failed jobs keep their upload, they can still be re-run
+    keep_statuses = ACTIVE_JOB_STATUSES + ("Failed",)
+    session = job_db.get_local_session()()
+    try:
+        needed_uploads = {
+            os.path.normpath(row.file_path)
+            for row in session.query(DocumentAnalysisJobs.file_path).filter(DocumentAnalysisJobs.job_status.in_(keep_statuses))
+        }
+        running_jobs = {
+            row.job_id
+            for row in session.query(DocumentAnalysisJobs.job_id).filter(DocumentAnalysisJobs.job_status.in_(ACTIVE_JOB_STATUSES))
+        }
+    finally:
+        session.close()
+
+    removed = 0
+    cutoff = time.time() - grace_seconds
+    if os.path.isdir(upload_dir):
+        for entry in os.scandir(upload_dir):
+            # only uploads the API wrote (`doc_<name>_<uuid>.pdf`), other files in data/ are left alone
+            if not (entry.is_file() and entry.name.startswith("doc_")):
+                continue
+            if os.path.normpath(os.path.join(upload_dir, entry.name)) in needed_uploads or entry.stat().st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    if os.path.isdir(output_dir):
+        for entry in os.scandir(output_dir):
+            if not (entry.is_dir() and entry.name.startswith("Job_")):
+                continue
+            if entry.name in running_jobs or entry.stat().st_mtime > cutoff:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def run_retention(job_db: DocumentAnalysisJobDB = None) -> dict:
+    """Run every retention step once, returns how much each one removed or moved"""
+    job_db = job_db or DocumentAnalysisJobDB()
+    return {
+        "jobs_expired": expire_old_jobs(job_db),
+        "results_archived": archive_large_results(job_db),
+        "files_swept": sweep_orphaned_files(job_db),
+    }
+
+
+if __name__ == "__main__":
+    print(run_retention())
@@ -1,15 +1,69 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from collections import Counter
+import base64
+import binascii
+from datetime import datetime, timezone
+import hashlib
+import json
+import math
 import os
+import re
 import uuid
+from typing import List, Optional
+from celery import chain, group
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 import uvicorn
-from job_database.job_db import DocumentAnalysisJobDB, DocumentAnalysisJobs
-from celery_jobs.analysis_worker import analyze_document_task
+import redis
+from job_database.job_db import (
+    DocumentAnalysisJobDB, DocumentAnalysisJobs, DocumentAnalysisStages, DocumentAnalysisBatches, DocumentAnalysisBatchJobs, make_dedup_key, find_reusable_job,
+    read_job_result, aggregate_job_metrics, estimate_queue_backlog,
+)
+from celery_jobs.job_events import subscribe_job_events, TERMINAL_EVENTS
+# only the lightweight Celery app is imported, the crew stack stays in the worker process
+from celery_jobs.celery_app import (
+    celery_app, ANALYZE_DOCUMENT_TASK, PREPARE_DOCUMENT_TASK, EXECUTION_MODES, DEFAULT_EXECUTION_MODE, ANALYSIS_MODES, DEFAULT_ANALYSIS_MODE,
+    LLM_MODEL, DEDUP_FRESHNESS_SECONDS, JOB_QUEUES, QUEUE_WORKERS, ADMISSION_MAX_BACKLOG_SECONDS, DEFAULT_JOB_SECONDS, JOB_STAGE_COUNT,
+    job_queue_class,
+)
 
 
 
 app = FastAPI(title="Financial Document Analyzer (With Job Worker Queues)")
 
+# Uploads are streamed to disk in chunks of this size and rejected above MAX_UPLOAD_MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "100"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Total size of the files of one batch submission
+MAX_BATCH_UPLOAD_MB = int(os.getenv("MAX_BATCH_UPLOAD_MB", "500"))
+MAX_BATCH_UPLOAD_BYTES = MAX_BATCH_UPLOAD_MB * 1024 * 1024
+# Room for the multipart boundaries and the other form fields on top of the file itself
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+# The PDF spec lets the `%PDF-` header start anywhere in the first 1024 bytes
+PDF_MAGIC = b"%PDF-"
+PDF_MAGIC_SEARCH_BYTES = 1024
+# Page count estimate for queue routing, read off the page objects (and page tree counts) while the upload streams by.
+# PDFs that keep their objects in compressed streams show neither, their size stands in at this many bytes per page
+PDF_PAGE_OBJECT_RE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+PDF_PAGE_COUNT_RE = re.compile(rb"/Count\s+(\d+)")
+PDF_BYTES_PER_PAGE_ESTIMATE = int(os.getenv("PDF_BYTES_PER_PAGE_ESTIMATE", str(50 * 1024)))
+# Bytes of the previous chunk scanned again with the next one, so markers split across chunks are still found
+PDF_SCAN_OVERLAP = 64
+# A batch submission creates at most this many jobs (files x queries)
+MAX_BATCH_JOBS = int(os.getenv("MAX_BATCH_JOBS", "500"))
+DEFAULT_QUERY = "Analyze this financial document for investment insights"
+# An SSE comment is sent after this many idle seconds, so proxies keep the stream open
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Page size bounds of GET /jobs
+JOB_LIST_DEFAULT_LIMIT = 50
+JOB_LIST_MAX_LIMIT = 200
+# Job states after which no more events follow
+FINISHED_JOB_STATUSES = ("Completed", "Failed")
+
 # create a dependency for sqlite db
 
 def get_db():
@@ -21,6 +75,130 @@ def get_db():
         db.close()
 
 
+def validate_job_options(execution_mode: str, analysis_mode: str):
+    """Reject unknown per-job options before anything is stored or queued"""
+    if execution_mode not in EXECUTION_MODES:
+        raise HTTPException(status_code=422, detail=f"execution_mode must be one of {', '.join(EXECUTION_MODES)}")
+    if analysis_mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=422, detail=f"analysis_mode must be one of {', '.join(ANALYSIS_MODES)}")
+
+
+async def save_upload(file: UploadFile, file_path: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                      too_large_detail: str = f"Uploaded file is larger than {MAX_UPLOAD_MB} MB.") -> tuple:
+    """
+    Stream an uploaded PDF to disk chunk by chunk, hashing it and estimating its page count on the way,
+    so API memory stays flat whatever the file size.
+
+    Args:
+    file (UploadFile): Uploaded file
+    file_path (str): Destination path, removed again if the upload is rejected
+    max_bytes (int, optional): Size past which the upload is rejected with 413
+    too_large_detail (str, optional): Error detail of that 413
+
+    Returns:
+    tuple: `(content_hash, page_estimate, size)`, the hex SHA-256 digest of the file content, its estimated page count and bytes
+    """
+    digest = hashlib.sha256()
+    size = 0
+    page_objects = 0
+    page_tree_count = 0
+    tail = b""
+    try:
+        head = await file.read(UPLOAD_CHUNK_SIZE)
+        if PDF_MAGIC not in head[:PDF_MAGIC_SEARCH_BYTES]:
+            raise HTTPException(status_code=415, detail="Uploaded file is not a PDF document.")
+
+        with open(file_path, "wb") as f:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=too_large_detail)
+                digest.update(chunk)
+                f.write(chunk)
+                # only matches ending in the new chunk count, the overlap was already scanned with the previous one
+                window = tail + chunk
+                page_objects += sum(1 for match in PDF_PAGE_OBJECT_RE.finditer(window) if match.end() > len(tail))
+                page_tree_count = max(
+                    [page_tree_count] + [int(match.group(1)) for match in PDF_PAGE_COUNT_RE.finditer(window) if match.end() > len(tail)]
+                )
+                tail = window[-PDF_SCAN_OVERLAP:]
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    page_estimate = max(page_objects, page_tree_count) or math.ceil(size / PDF_BYTES_PER_PAGE_ESTIMATE)
+    return digest.hexdigest(), page_estimate, size
+
+
+def get_queue_backlogs(db: Session, queue_classes) -> dict:
+    """`{size class: (backlog_jobs, seconds_per_job)}` of the given classes, see `estimate_queue_backlog`"""
+    return {
+        queue_class: estimate_queue_backlog(db, queue_class, DEFAULT_JOB_SECONDS[queue_class], JOB_STAGE_COUNT)
+        for queue_class in set(queue_classes)
+    }
+
+
+def admit_jobs(backlogs: dict, new_jobs: Counter):
+    """
+    Admission control: turn a submission away (429) if it would push a queue's estimated wait past its limit.
+    The estimated wait is the work left in the queue (queued and running jobs weighted by their remaining stages, plus the
+    new jobs) times the recent average job time, over the queue's workers.
+
+    Args:
+    backlogs (dict): From `get_queue_backlogs`, taken before the new jobs were added
+    new_jobs (Counter): Jobs the submission would create per size class
+    """
+    for queue_class, count in new_jobs.items():
+        limit = ADMISSION_MAX_BACKLOG_SECONDS[queue_class]
+        if not limit or not count:
+            continue
+        backlog_jobs, seconds_per_job = backlogs[queue_class]
+        backlog_seconds = (backlog_jobs + count) * seconds_per_job / max(1, QUEUE_WORKERS[queue_class])
+        if backlog_seconds > limit:
+            raise HTTPException(
+                status_code=429,
+                detail=f"The {queue_class} document queue is full (estimated wait {backlog_seconds:.0f}s, limit {limit}s), retry later.",
+                # roughly when enough of the backlog has drained for this submission to fit
+                headers={"Retry-After": str(max(1, math.ceil(backlog_seconds - limit)))},
+            )
+
+
+def attach_to_job(job: DocumentAnalysisJobs, file_path: str, filename: str) -> dict:
+    """Answer a duplicate submission with the job it shares, its own copy of the upload isn't needed"""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    in_flight = job.job_status != "Completed"
+    return {
+        "status": "success",
+        "message": "Identical analysis already in progress, attached to it." if in_flight else "Served from an identical completed analysis.",
+        "job_id": job.job_id,
+        "file_processed": filename,
+        "deduplicated": True,
+    }
+
+
+BATCH_TOO_LARGE_DETAIL = f"The files of a batch are larger than {MAX_BATCH_UPLOAD_MB} MB in total."
+# Largest request body each upload route can legitimately send and the error past it
+UPLOAD_ROUTE_LIMITS = {
+    "/analyze": (MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES, f"Uploaded file is larger than {MAX_UPLOAD_MB} MB."),
+    "/analyze/batch": (MAX_BATCH_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES, BATCH_TOO_LARGE_DETAIL),
+}
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Turn away uploads whose declared size is already over the limit, before the multipart body is read at all"""
+    limit = UPLOAD_ROUTE_LIMITS.get(request.url.path.rstrip("/")) if request.method == "POST" else None
+    if limit is not None:
+        max_bytes, detail = limit
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            return JSONResponse(status_code=413, content={"detail": detail})
+    return await call_next(request)
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -29,11 +207,16 @@ async def root():
 @app.post("/analyze/")
 async def analyze_financial_document(
     file: UploadFile = File(...),
-    query: str = Form(default="Analyze this financial document for investment insights"),
+    query: str = Form(default=DEFAULT_QUERY),
+    bypass_cache: bool = Form(default=False),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    analysis_mode: str = Form(default=DEFAULT_ANALYSIS_MODE),
     db: Session = Depends(get_db)
 ):
     """Analyze financial document and provide comprehensive investment recommendations"""
     
+    validate_job_options(execution_mode, analysis_mode)
+
     file_id = str(uuid.uuid4())
     file_path = f"data/doc_{file.filename}_{file_id}.pdf"
     
@@ -41,29 +224,66 @@ async def analyze_financial_document(
         # Ensure data directory exists
         os.makedirs("data", exist_ok=True)
         
-        # Save uploaded file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Stream the upload to disk, size and type are checked as it's written
+        content_hash, page_estimate, _ = await save_upload(file, file_path)
+        queue_class = job_queue_class(page_estimate)
         
         # Validate query
         if query=="" or query is None:
-            query = "Analyze this financial document for investment insights"
+            query = DEFAULT_QUERY
+
+        # Coalesce identical submissions (same bytes, query and model) onto one job, unless the caller wants a fresh run
+        dedup_key = None
+        if not bypass_cache:
+            dedup_key = make_dedup_key(content_hash, query, LLM_MODEL)
+            existing_job = find_reusable_job(db, dedup_key, DEDUP_FRESHNESS_SECONDS)
+            if existing_job is not None:
+                return attach_to_job(existing_job, file_path, file.filename)
+
+        # only new jobs go through admission control, attaching to an existing one adds no work
+        admit_jobs(get_queue_backlogs(db, [queue_class]), Counter({queue_class: 1}))
             
         # Create a new job entry in DB
-        new_analysis_job = DocumentAnalysisJobs(file_path=file_path, analysis_query=query)
+        new_analysis_job = DocumentAnalysisJobs(
+            file_path=file_path, analysis_query=query, content_hash=content_hash, dedup_key=dedup_key,
+            page_estimate=page_estimate, queue_class=queue_class,
+        )
         db.add(new_analysis_job)
-        db.commit()
+        try:
+            db.commit()
+        except IntegrityError:
+            # an identical submission created its job in the meantime (unique while in flight), share that one
+            db.rollback()
+            existing_job = find_reusable_job(db, dedup_key, 0) if dedup_key else None
+            if existing_job is None:
+                raise
+            return attach_to_job(existing_job, file_path, file.filename)
         
-        analyze_document_task.delay(job_id=new_analysis_job.job_id, file_path=file_path, query=query)
+        celery_app.send_task(
+            ANALYZE_DOCUMENT_TASK,
+            kwargs={
+                "job_id": new_analysis_job.job_id, "file_path": file_path, "query": query,
+                "bypass_cache": bypass_cache, "execution_mode": execution_mode, "analysis_mode": analysis_mode,
+                "content_hash": content_hash,
+            },
+            queue=JOB_QUEUES[queue_class],
+        )
         
         return {
             "status": "success",
             "message": "Analysis Job created and submitted.",
             "job_id": new_analysis_job.job_id,
-            "file_processed": file.filename
+            "file_processed": file.filename,
+            "deduplicated": False,
+            "page_estimate": page_estimate,
+            "queue_class": queue_class,
         }
         
+    except HTTPException:
+        # uploads rejected by `save_upload` are already removed, ones turned away by admission control aren't
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
     except Exception as e:
         if os.path.exists(file_path):
             try:
@@ -72,6 +292,155 @@ async def analyze_financial_document(
                 pass  # Ignore cleanup errors
         raise HTTPException(status_code=500, detail=f"Error processing financial document: {str(e)}")
 
+@app.post("/analyze/batch/")
+async def analyze_financial_documents_batch(
+    files: List[UploadFile] = File(...),
+    queries: List[str] = Form(default=[]),
+    bypass_cache: bool = Form(default=False),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    analysis_mode: str = Form(default=DEFAULT_ANALYSIS_MODE),
+    db: Session = Depends(get_db)
+):
+    """Analyze many documents (or one document with many queries) in one request, every file is analyzed for every query"""
+
+    validate_job_options(execution_mode, analysis_mode)
+    queries = [query for query in queries if query and query.strip()] or [DEFAULT_QUERY]
+    if len(files) * len(queries) > MAX_BATCH_JOBS:
+        raise HTTPException(status_code=422, detail=f"A batch can create at most {MAX_BATCH_JOBS} jobs (files x queries).")
+    # the multipart parser has spooled the files already, so a chunked request without Content-Length is still turned away before anything is stored
+    if sum(file.size or 0 for file in files) > MAX_BATCH_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=BATCH_TOO_LARGE_DETAIL)
+
+    # content hash -> stored path, identical bytes uploaded twice in a batch are stored and parsed once
+    documents = {}
+    try:
+        os.makedirs("data", exist_ok=True)
+        job_specs = []
+        batch_bytes = 0
+        for file in files:
+            file_path = f"data/doc_{file.filename}_{str(uuid.uuid4())}.pdf"
+            # each file gets the smaller of the per-file limit and what is left of the batch's total
+            remaining_bytes = MAX_BATCH_UPLOAD_BYTES - batch_bytes
+            if remaining_bytes < MAX_UPLOAD_BYTES:
+                content_hash, page_estimate, size = await save_upload(file, file_path, remaining_bytes, BATCH_TOO_LARGE_DETAIL)
+            else:
+                content_hash, page_estimate, size = await save_upload(file, file_path)
+            batch_bytes += size
+            if content_hash in documents:
+                os.remove(file_path)
+            else:
+                documents[content_hash] = file_path
+            job_specs.extend((documents[content_hash], content_hash, page_estimate, query) for query in queries)
+        # taken before any job of the batch is added, so the batch is admitted against the queues as they were
+        backlogs = get_queue_backlogs(db, [job_queue_class(spec[2]) for spec in job_specs])
+
+        # all rows go in one transaction, coalescing with in-flight/fresh jobs and within the batch like /analyze does
+        try:
+            batch = DocumentAnalysisBatches(batch_id=f"Batch_{str(uuid.uuid4())}")
+            db.add(batch)
+            jobs_by_key = {}
+            batch_job_ids = []
+            new_jobs = []
+            for file_path, content_hash, page_estimate, query in job_specs:
+                dedup_key = None if bypass_cache else make_dedup_key(content_hash, query, LLM_MODEL)
+                job = jobs_by_key.get(dedup_key) if dedup_key else None
+                if job is None and dedup_key:
+                    job = find_reusable_job(db, dedup_key, DEDUP_FRESHNESS_SECONDS)
+                if job is None:
+                    job = DocumentAnalysisJobs(
+                        job_id=f"Job_{str(uuid.uuid4())}", file_path=file_path, analysis_query=query,
+                        content_hash=content_hash, dedup_key=dedup_key,
+                        page_estimate=page_estimate, queue_class=job_queue_class(page_estimate),
+                    )
+                    db.add(job)
+                    new_jobs.append(job)
+                if dedup_key:
+                    jobs_by_key[dedup_key] = job
+                if job.job_id not in batch_job_ids:
+                    batch_job_ids.append(job.job_id)
+                    db.add(DocumentAnalysisBatchJobs(batch_id=batch.batch_id, job_id=job.job_id))
+            # the whole batch is admitted or turned away, nothing is committed before
+            admit_jobs(backlogs, Counter(job.queue_class for job in new_jobs))
+            db.commit()
+        except IntegrityError:
+            # an identical job was created concurrently (unique while in flight)
+            db.rollback()
+            raise HTTPException(status_code=409, detail="An identical analysis was submitted at the same time, please retry the batch.")
+
+        # one workflow per document: parse it once, then fan out to the jobs querying it
+        jobs_by_document = {}
+        for job in new_jobs:
+            jobs_by_document.setdefault(job.file_path, []).append(
+                celery_app.signature(ANALYZE_DOCUMENT_TASK, kwargs={
+                    "job_id": job.job_id, "file_path": job.file_path, "query": job.analysis_query,
+                    "bypass_cache": bypass_cache, "execution_mode": execution_mode, "analysis_mode": analysis_mode,
+                    "content_hash": job.content_hash,
+                }, immutable=True, queue=JOB_QUEUES[job.queue_class])
+            )
+        queue_classes = {job.file_path: job.queue_class for job in new_jobs}
+        workflows = []
+        for content_hash, file_path in documents.items():
+            if file_path not in jobs_by_document:
+                # every query of this document was served by an existing job
+                os.remove(file_path)
+                continue
+            prepare = celery_app.signature(
+                PREPARE_DOCUMENT_TASK, kwargs={"file_path": file_path, "content_hash": content_hash}, immutable=True,
+                queue=JOB_QUEUES[queue_classes[file_path]],
+            )
+            workflows.append(chain(prepare, group(jobs_by_document[file_path])))
+        if workflows:
+            group(workflows).apply_async()
+
+        return {
+            "status": "success",
+            "message": "Batch created and submitted.",
+            "batch_id": batch.batch_id,
+            "job_ids": batch_job_ids,
+            "documents": len(documents),
+            "jobs_created": len(new_jobs),
+            "jobs_deduplicated": len(batch_job_ids) - len(new_jobs),
+        }
+
+    except Exception as e:
+        for file_path in documents.values():
+            if os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except:
+                    pass  # Ignore cleanup errors
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing financial documents: {str(e)}")
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str, db: Session = Depends(get_db)):
+    """A GET Endpoint for the aggregate progress of a batch, job results are fetched per job through /status/{job_id}"""
+    batch = db.query(DocumentAnalysisBatches).filter(DocumentAnalysisBatches.batch_id == batch_id).first()
+    if not batch: raise HTTPException(status_code=404, detail=f"Batch with {batch_id} doesn't exist.")
+
+    jobs = (
+        db.query(DocumentAnalysisJobs.job_id, DocumentAnalysisJobs.job_status, DocumentAnalysisJobs.analysis_query)
+        .join(DocumentAnalysisBatchJobs, DocumentAnalysisBatchJobs.job_id == DocumentAnalysisJobs.job_id)
+        .filter(DocumentAnalysisBatchJobs.batch_id == batch_id)
+        .all()
+    )
+    status_counts = Counter(job.job_status for job in jobs)
+    finished = status_counts["Completed"] + status_counts["Failed"]
+
+    return {
+        "batch_id": batch.batch_id,
+        "batch_created_at": batch.created_at,
+        "total_jobs": len(jobs),
+        "finished_jobs": finished,
+        "progress": round(finished / len(jobs), 4) if jobs else 1.0,
+        "status_counts": dict(status_counts),
+        "jobs": [
+            {"job_id": job.job_id, "job_status": job.job_status, "analysis_query": job.analysis_query}
+            for job in jobs
+        ],
+    }
+
 @app.get("/status/{job_id}")
 async def get_job_status(job_id: str, db: Session = Depends(get_db)):
     """A GET Endpoint to check the status or progress of our submitted job."""
@@ -83,9 +452,267 @@ async def get_job_status(job_id: str, db: Session = Depends(get_db)):
         "job_status" : job.job_status,
         "job_created_at" : job.created_at,
         "job_updated_at" : job.updated_at,
-        "job_result" : job.job_result,
+        "job_result" : read_job_result(job),
+        "job_metrics" : json.loads(job.job_metrics) if job.job_metrics else None,
     }
 
+def get_job_summary(db: Session, job_id: str):
+    """Read a job's state without the (potentially large) result column"""
+    return (
+        db.query(
+            DocumentAnalysisJobs.job_id, DocumentAnalysisJobs.job_status, DocumentAnalysisJobs.job_stage,
+            DocumentAnalysisJobs.created_at, DocumentAnalysisJobs.updated_at,
+        )
+        .filter(DocumentAnalysisJobs.job_id == job_id)
+        .first()
+    )
+
+@app.get("/status/{job_id}/summary")
+async def get_job_status_summary(job_id: str, db: Session = Depends(get_db)):
+    """A GET Endpoint for polling a job's progress cheaply, the result is left out (fetch it once from /status/{job_id})"""
+    job = get_job_summary(db, job_id)
+    if not job: raise HTTPException(status_code=404, detail=f"Job with {job_id} doesn't exist.")
+
+    return {
+        "job_id" : job.job_id,
+        "job_status" : job.job_status,
+        "job_stage" : job.job_stage,
+        "job_created_at" : job.created_at,
+        "job_updated_at" : job.updated_at,
+    }
+
+@app.get("/status/{job_id}/stages")
+async def get_job_stages(job_id: str, db: Session = Depends(get_db)):
+    """A GET Endpoint for the full output of every finished stage of a job (later stages only read digests of them as context)"""
+    job = get_job_summary(db, job_id)
+    if not job: raise HTTPException(status_code=404, detail=f"Job with {job_id} doesn't exist.")
+
+    stages = (
+        db.query(DocumentAnalysisStages)
+        .filter(DocumentAnalysisStages.job_id == job_id)
+        .order_by(DocumentAnalysisStages.completed_at)
+        .all()
+    )
+    return {
+        "job_id" : job.job_id,
+        "job_status" : job.job_status,
+        "stages" : [
+            {"stage" : stage.stage, "completed_at" : stage.completed_at, "output" : stage.stage_output}
+            for stage in stages
+        ],
+    }
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str, db: Session = Depends(get_db)):
+    """Server-Sent Events stream of a job's stage transitions, starting with its current state and ending when it finishes"""
+    job = get_job_summary(db, job_id)
+    if not job: raise HTTPException(status_code=404, detail=f"Job with {job_id} doesn't exist.")
+
+    # subscribe before reading the snapshot, so a transition in between is still delivered
+    try:
+        pubsub = await subscribe_job_events(job_id)
+    except redis.RedisError as e:
+        # without the event channel the stream is just the current state, the client reconnects or polls /status
+        print(f"Could not subscribe to the events of job {job_id}: {e}")
+        pubsub = None
+    job = get_job_summary(db, job_id)
+    snapshot = {"job_id": job.job_id, "job_status": job.job_status, "job_stage": job.job_stage, "job_updated_at": job.updated_at}
+
+    async def event_stream():
+        try:
+            yield format_sse("status", snapshot)
+            if pubsub is None or snapshot["job_status"] in FINISHED_JOB_STATUSES:
+                return
+            while True:
+                try:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+                except redis.RedisError as e:
+                    # end the stream instead of failing it, a reconnect starts again from the current state
+                    print(f"Lost the events of job {job_id}: {e}")
+                    return
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                yield format_sse(event["event"], event)
+                if event["event"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            if pubsub is not None:
+                await pubsub.aclose()
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def encode_job_cursor(created_at: datetime, job_id: str) -> str:
+    """Opaque keyset cursor: the sort key of the last job of a page"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{job_id}".encode()).decode()
+
+def decode_job_cursor(cursor: str):
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), job_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid cursor, pass the next_cursor of a previous page.")
+
+def to_db_time(value: datetime) -> datetime:
+    """Query times may come with any offset, the database stores naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@app.get("/jobs/")
+async def list_jobs(
+    status: List[str] = Query(default=[]),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(default=JOB_LIST_DEFAULT_LIMIT, ge=1, le=JOB_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """A GET Endpoint listing jobs newest first, filtered by status and creation time, paginated by keyset (no results included)"""
+    jobs = db.query(
+        DocumentAnalysisJobs.job_id, DocumentAnalysisJobs.job_status, DocumentAnalysisJobs.job_stage,
+        DocumentAnalysisJobs.analysis_query, DocumentAnalysisJobs.created_at, DocumentAnalysisJobs.updated_at,
+    )
+    if status:
+        jobs = jobs.filter(DocumentAnalysisJobs.job_status.in_(status))
+    if created_after is not None:
+        jobs = jobs.filter(DocumentAnalysisJobs.created_at >= to_db_time(created_after))
+    if created_before is not None:
+        jobs = jobs.filter(DocumentAnalysisJobs.created_at < to_db_time(created_before))
+    if cursor:
+        # continue strictly after the last job of the previous page, stable while new jobs keep arriving
+        cursor_created_at, cursor_job_id = decode_job_cursor(cursor)
+        jobs = jobs.filter(or_(
+            DocumentAnalysisJobs.created_at < cursor_created_at,
+            and_(DocumentAnalysisJobs.created_at == cursor_created_at, DocumentAnalysisJobs.job_id < cursor_job_id),
+        ))
+
+    rows = jobs.order_by(DocumentAnalysisJobs.created_at.desc(), DocumentAnalysisJobs.job_id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+
+    return {
+        "jobs": [
+            {
+                "job_id" : job.job_id,
+                "job_status" : job.job_status,
+                "job_stage" : job.job_stage,
+                "analysis_query" : job.analysis_query,
+                "job_created_at" : job.created_at,
+                "job_updated_at" : job.updated_at,
+            }
+            for job in page
+        ],
+        "next_cursor": encode_job_cursor(page[-1].created_at, page[-1].job_id) if len(rows) > limit else None,
+    }
+
+@app.post("/rerun/{job_id}")
+async def rerun_job(
+    job_id: str,
+    bypass_cache: bool = Form(default=False),
+    execution_mode: str = Form(default=DEFAULT_EXECUTION_MODE),
+    analysis_mode: str = Form(default=DEFAULT_ANALYSIS_MODE),
+    db: Session = Depends(get_db)
+):
+    """Re-queue a failed job, stages it already finished are restored from their checkpoints instead of being re-run."""
+    validate_job_options(execution_mode, analysis_mode)
+
+    job = db.query(DocumentAnalysisJobs).filter(DocumentAnalysisJobs.job_id == job_id).first()
+    if not job: raise HTTPException(status_code=404, detail=f"Job with {job_id} doesn't exist.")
+    if job.job_status != "Failed":
+        raise HTTPException(status_code=409, detail=f"Job with {job_id} is {job.job_status}, only failed jobs can be re-run.")
+
+    queue_class = job.queue_class or job_queue_class(job.page_estimate)
+    admit_jobs(get_queue_backlogs(db, [queue_class]), Counter({queue_class: 1}))
+
+    job.job_status = "In Queue"
+    job.job_result = None
+    job.job_stage = None
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"An identical analysis is already in flight, re-submitting {job_id} would duplicate it.")
+
+    celery_app.send_task(
+        ANALYZE_DOCUMENT_TASK,
+        kwargs={
+            "job_id": job.job_id, "file_path": job.file_path, "query": job.analysis_query,
+            "bypass_cache": bypass_cache, "execution_mode": execution_mode, "analysis_mode": analysis_mode,
+        },
+        queue=JOB_QUEUES[queue_class],
+    )
+
+    return {
+        "status": "success",
+        "message": "Analysis Job re-submitted, checkpointed stages will be skipped.",
+        "job_id": job.job_id,
+    }
+
+def _prometheus_label_value(value) -> str:
+    """Escape a label value for the text exposition format (backslash, double quote and line feed)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus_metrics(aggregate: dict) -> str:
+    """Render `aggregate_job_metrics` in the Prometheus text exposition format
+
+    Totals are counters and time spent is a summary (`_sum` and `_count`). They are summed over the jobs still in the
+    database, so they drop when the retention job expires old jobs, which Prometheus treats as a counter reset.
+    """
+    jobs = aggregate["jobs"]
+    # (name, type, help, [(sample suffix, labels, value), ...])
+    metrics = [
+        ("document_analysis_jobs", "gauge", "Jobs in the database by status",
+         [("", {"status": status}, count) for status, count in aggregate["jobs_by_status"].items()]),
+        ("document_analysis_job_attempts_total", "counter", "Attempts of instrumented jobs, retries and re-runs included",
+         [("", {}, jobs["attempts"])]),
+        ("document_analysis_job_retries_total", "counter", "Attempts beyond the first one", [("", {}, jobs["attempts"] - jobs["jobs"])]),
+        ("document_analysis_job_queue_wait_seconds", "summary", "Time jobs waited in the queue",
+         [("_sum", {}, jobs["queue_wait_seconds"]), ("_count", {}, jobs["jobs"])]),
+        ("document_analysis_job_processing_seconds", "summary", "Time workers spent on jobs",
+         [("_sum", {}, jobs["processing_seconds"]), ("_count", {}, jobs["jobs"])]),
+        ("document_analysis_stage_seconds", "summary", "Time spent per stage, counted per finished stage run",
+         [(suffix, {"stage": stage}, row[field]) for stage, row in aggregate["stages"].items() for suffix, field in (("_sum", "seconds"), ("_count", "runs"))]),
+    ]
+    stage_fields = [
+        ("llm_requests", "document_analysis_stage_llm_requests_total", "LLM requests sent to the provider per stage"),
+        ("prompt_tokens", "document_analysis_stage_prompt_tokens_total", "Prompt tokens per stage"),
+        ("completion_tokens", "document_analysis_stage_completion_tokens_total", "Completion tokens per stage"),
+        ("llm_cache_hits", "document_analysis_stage_llm_cache_hits_total", "LLM calls answered by the response cache per stage"),
+        ("llm_cache_misses", "document_analysis_stage_llm_cache_misses_total", "LLM calls that missed the response cache per stage"),
+        ("pdf_cache_hits", "document_analysis_stage_pdf_cache_hits_total", "Documents whose cleaned pages came from the PDF extraction cache"),
+        ("pdf_cache_misses", "document_analysis_stage_pdf_cache_misses_total", "Documents parsed because the PDF extraction cache missed"),
+    ]
+    for field, name, help_text in stage_fields:
+        metrics.append((name, "counter", help_text, [("", {"stage": stage}, row[field]) for stage, row in aggregate["stages"].items()]))
+    metrics += [
+        ("document_analysis_tool_seconds", "summary", "Time spent in agent tools, counted per call",
+         [(suffix, {"tool": tool}, row[field]) for tool, row in aggregate["tools"].items() for suffix, field in (("_sum", "seconds"), ("_count", "calls"))]),
+        ("document_analysis_tool_cache_hits_total", "counter", "Agent tool calls answered by crewai's tool cache",
+         [("", {"tool": tool}, row["cache_hits"]) for tool, row in aggregate["tools"].items()]),
+    ]
+
+    lines = []
+    for name, metric_type, help_text, samples in metrics:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{label}="{_prometheus_label_value(label_value)}"' for label, label_value in labels.items())
+            sample = f"{name}{suffix}{{{label_text}}}" if label_text else f"{name}{suffix}"
+            lines.append(f"{sample} {float(value or 0)!r}")
+    return "\n".join(lines) + "\n"
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(db: Session = Depends(get_db)):
+    """Prometheus scrape endpoint: job counts, stage timings, token usage, cache hits and retries summed over the stored jobs"""
+    return PlainTextResponse(format_prometheus_metrics(aggregate_job_metrics(db)), media_type="text/plain; version=0.0.4")
+
 # Run the app with Uvicorn
 if __name__ == "__main__":
     uvicorn.run(